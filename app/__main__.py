@@ -1,16 +1,24 @@
 import logging
 import asyncio
 
+from typing import Optional, Callable, Awaitable, Tuple
+
 from aiogram import Dispatcher, Bot, F
-from aiogram.types import ReplyKeyboardRemove, BufferedInputFile, BotCommandScopeChat
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import ReplyKeyboardRemove, BufferedInputFile, FSInputFile, BotCommandScopeChat
 from aiogram.enums import ParseMode
 
 from app.args_reader import args
 from app.config_reader import config
 from app.utils import create_status_text
 from app.printer import Printer
-from app.webcam import get_webcam_image
-from app.moonraker import Moonraker
+from app.farm import Farm, Machine
+from app.outbox import Outbox, OutboxMiddleware
+from app.notifier import Notifier, Content
+from app.subscribers import SubscriberRegistry
+from app.metrics import metrics, MetricsServer, TelegramMetricsMiddleware
+from app.webhook import WebhookServer
 from app.handlers import setup_router, setup_commands
 
 logging.basicConfig(
@@ -21,66 +29,183 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-async def send_status(printer: Printer, bot: Bot) -> None:
-    text = create_status_text(printer)
-    image = await get_webcam_image()
-    if image is not None:
-        await bot.send_photo(chat_id=config.telegram.chat_id, photo=BufferedInputFile(image, 'live_view.png'), caption=text)
+def build_status(farm: Farm, machine: Machine) -> Callable[[], Awaitable[Content]]:
+    async def build() -> Content:
+        text = farm.caption(machine, create_status_text(machine.printer))
+        image = await machine.snapshot()
+        return text, BufferedInputFile(image, 'live_view.jpg') if image is not None else None
+    return build
+
+def state_events(state: str) -> Tuple[str, ...]:
+    return ('state', 'errors') if state in ('error', 'shutdown') else ('state',)
+
+def state_priority(state: str) -> int:
+    # errors jump the queue
+    return Outbox.PRIORITY_HIGH if state in ('error', 'shutdown') else Outbox.PRIORITY_NORMAL
+
+def setup_live_status_listeners(farm: Farm, machine: Machine, notifier: Notifier) -> None:
+    previous_state = machine.printer.state
+
+    async def callback_state_changed(printer: Printer, state: str) -> None:
+        nonlocal previous_state
+        # printer reset on reconnect doesn't emit "disconnected", so printing may follow printing
+        reconnected = previous_state in ('disconnected', 'printing')
+        previous_state = state
+
+        if state == 'printing':
+            # keep editing the same message after moonraker / klipper reconnect
+            notifier.notify_live(
+                machine.name, state_events(state), build_status(farm, machine),
+                tag=printer.data.print_stats.filename, update=reconnected,
+                priority=state_priority(state), key=f'live:{machine.name}'
+            )
+            return
+
+        # same key as progress edits: a queued edit is replaced, the one in flight goes out before the forget
+        notifier.notify(
+            machine.name, state_events(state), build_status(farm, machine),
+            priority=state_priority(state), key=f'live:{machine.name}', forget_live=state != 'disconnected'
+        )
+
+    async def callback_progress_changed(printer: Printer, progress: float) -> None:
+        notifier.notify_live(
+            machine.name, ('progress',), build_status(farm, machine),
+            tag=printer.data.print_stats.filename, update=True, key=f'live:{machine.name}'
+        )
+
+    if 'state' in machine.config.moonraker.notification_events:
+        machine.printer.add_listener('state_changed', callback_state_changed)
+    if 'progress' in machine.config.moonraker.notification_events:
+        machine.printer.add_listener('progress_changed', callback_progress_changed)
+
+def setup_status_listeners(farm: Farm, machine: Machine, notifier: Notifier) -> None:
+    def notify(events: Tuple[str, ...], priority: int = Outbox.PRIORITY_NORMAL) -> None:
+        # a queued status of the printer is replaced by the newer one
+        notifier.notify(
+            machine.name, events, build_status(farm, machine), priority=priority, key=f'status:{machine.name}'
+        )
+
+    async def callback_state_changed(printer: Printer, state: str) -> None:
+        notify(state_events(state), state_priority(state))
+
+    async def callback_progress_changed(printer: Printer, progress: float) -> None:
+        notify(('progress',))
+
+    if 'state' in machine.config.moonraker.notification_events:
+        machine.printer.add_listener('state_changed', callback_state_changed)
+    if 'progress' in machine.config.moonraker.notification_events:
+        machine.printer.add_listener('progress_changed', callback_progress_changed)
+
+def setup_machine_listeners(farm: Farm, machine: Machine, notifier: Notifier) -> None:
+    if config.telegram.live_status:
+        setup_live_status_listeners(farm, machine, notifier)
     else:
-        await bot.send_message(chat_id=config.telegram.chat_id, text=text)
-
-async def send_message_from_printer(printer: Printer, bot: Bot) -> None:
-    message = printer.data['display_status']['message']
-    await bot.send_message(chat_id=config.telegram.chat_id, text=f'printer: <i>{message}</i>')
-
-async def on_startup(dispatcher: Dispatcher, bot: Bot, moonraker: Moonraker):
-    async def callback_progress_changed(printer: Printer) -> None:
-        if printer.data is not None:
-            await send_status(printer, bot)
-    if 'state' in config.moonraker.notification_events:
-        moonraker.printer.add_listener('state_changed', callback_progress_changed)
-    if 'progress' in config.moonraker.notification_events:
-        moonraker.printer.add_listener('progress_changed', callback_progress_changed)
-
-    async def callback_message(printer: Printer) -> None:
-        await send_message_from_printer(printer, bot)
-    moonraker.printer.add_listener('message', callback_message)
-
-    await moonraker.open()
-
-    await bot.set_my_commands(commands=setup_commands(), scope=BotCommandScopeChat(chat_id=config.telegram.chat_id))
-    await bot.delete_webhook(drop_pending_updates=True)
-    await bot.send_message(
-        config.telegram.chat_id,
-        f'\N{Black Right-Pointing Pointer} <i>bot going online</i>', reply_markup=ReplyKeyboardRemove()
-    )
-
-async def on_shutdown(dispatcher: Dispatcher, bot: Bot, moonraker: Moonraker):
-    await bot.send_message(config.telegram.chat_id, f'\N{Black Left-Pointing Pointer} <i>bot going offline</i>')
-    await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=config.telegram.chat_id))
-    await moonraker.close()
+        setup_status_listeners(farm, machine, notifier)
+
+    async def callback_message(printer: Printer, message: str) -> None:
+        text = farm.caption(machine, f'printer: <i>{message}</i>')
+
+        async def build() -> Content:
+            return text, None
+        notifier.notify(machine.name, ('messages',), build)
+    machine.printer.add_listener('message', callback_message)
+
+    if config.timelapse.enabled:
+        async def callback_timelapse_state_changed(printer: Printer, state: str) -> None:
+            video = await machine.timelapse.update_state(state)
+            if video is not None:
+                filename = machine.printer.data.print_stats.filename
+                try:
+                    # uploaded once, the other chats get the same file id
+                    await asyncio.gather(*notifier.send_video(
+                        machine.name, ('state',), FSInputFile(video, 'timelapse.mp4'),
+                        caption=farm.caption(machine, f'\N{Film Frames} <i>timelapse:</i> <b>{filename}</b>')
+                    ))
+                finally:
+                    machine.timelapse.cleanup()
+        machine.printer.add_listener('state_changed', callback_timelapse_state_changed)
+
+        async def callback_timelapse_layer_changed(printer: Printer, layer: float) -> None:
+            await machine.timelapse.on_layer_changed()
+        machine.printer.add_listener('layer_changed', callback_timelapse_layer_changed)
+
+async def on_startup(dispatcher: Dispatcher, bot: Bot, farm: Farm, outbox: Outbox, notifier: Notifier,
+                     subscribers: SubscriberRegistry, metrics_server: Optional[MetricsServer]):
+    for machine in farm:
+        setup_machine_listeners(farm, machine, notifier)
+
+    await outbox.open()
+    await farm.open()
+    if metrics_server:
+        await metrics_server.open()
+
+    for chat_id in subscribers.command_chat_ids:
+        await bot.set_my_commands(commands=setup_commands(), scope=BotCommandScopeChat(chat_id=chat_id))
+    if config.telegram.mode != 'webhook':
+        # the webhook server sets its webhook once it listens
+        await bot.delete_webhook(drop_pending_updates=True)
+    notifier.broadcast(f'\N{Black Right-Pointing Pointer} <i>bot going online</i>', reply_markup=ReplyKeyboardRemove())
+
+async def on_shutdown(dispatcher: Dispatcher, bot: Bot, farm: Farm, outbox: Outbox, notifier: Notifier,
+                      subscribers: SubscriberRegistry, metrics_server: Optional[MetricsServer]):
+    await asyncio.gather(*notifier.broadcast(
+        f'\N{Black Left-Pointing Pointer} <i>bot going offline</i>', priority=Outbox.PRIORITY_HIGH
+    ))
+    for chat_id in subscribers.command_chat_ids:
+        await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=chat_id))
+    await farm.close()
+    await outbox.close()
+    if metrics_server:
+        await metrics_server.close()
 
 async def main():
     logger.info(f'config:\n{config}')
 
-    moonraker = Moonraker(
-        endpoint=config.moonraker.endpoint
-    )
+    if config.telegram.mode not in ('polling', 'webhook'):
+        raise ValueError(f'unknown telegram mode "{config.telegram.mode}", expected polling or webhook')
 
-    # accept messages only from configured chat id
-    router = setup_router()
-    router.message.filter(F.chat.id == config.telegram.chat_id)
+    metrics.enabled = config.metrics.enabled
+    metrics_server = None
+    if config.metrics.enabled and config.metrics.prometheus_port:
+        metrics_server = MetricsServer(config.metrics.prometheus_host, config.metrics.prometheus_port)
+
+    farm = Farm(config)
+    outbox = Outbox()
+    subscribers = SubscriberRegistry(config.chats)
 
-    # pass moonraker to dispatcher constructor
-    # now "moonraker: Moonraker" could be arg for a handler
-    dp = Dispatcher(moonraker=moonraker)
+    # accept messages and buttons only from chats allowed to send commands
+    router = setup_router()
+    router.message.filter(F.chat.id.in_(subscribers.command_chat_ids))
+    router.callback_query.filter(F.message.chat.id.in_(subscribers.command_chat_ids))
+
+    # a local Bot API server (or a fake one for testing) instead of api.telegram.org
+    session = AiohttpSession(api=TelegramAPIServer.from_base(config.telegram.api_server)) \
+        if config.telegram.api_server else None
+    bot = Bot(token=config.telegram.token, session=session, parse_mode=ParseMode.HTML)
+    notifier = Notifier(bot, outbox, subscribers)
+
+    # pass farm, outbox and notifier to dispatcher constructor
+    # now "farm: Farm" could be arg for a handler
+    dp = Dispatcher(
+        farm=farm, outbox=outbox, notifier=notifier, subscribers=subscribers, metrics_server=metrics_server
+    )
     dp.include_router(router)
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
-
-    bot = Bot(token=config.telegram.token, parse_mode=ParseMode.HTML)
-
-    await dp.start_polling(bot)
+    # command replies respect flood control of the chat, registered first to be the outer one:
+    # metrics measure the request itself, not the time waiting for the chat
+    bot.session.middleware(OutboxMiddleware(outbox))
+    if config.metrics.enabled:
+        bot.session.middleware(TelegramMetricsMiddleware())
+
+    if config.telegram.mode == 'webhook':
+        webhook = WebhookServer(
+            dp, bot, url=config.telegram.webhook_url, listen=config.telegram.webhook_listen,
+            path=config.telegram.webhook_path, secret=config.telegram.webhook_secret
+        )
+        await webhook.run()
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,167 @@
+import struct
+import zlib
+
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+Color = Tuple[int, int, int]
+
+BACKGROUND = (255, 255, 255)
+GRID = (225, 225, 225)
+AXIS = (150, 150, 150)
+
+# channel: (color, panel), targets are drawn with a lighter color of the heater
+COLORS: Dict[str, Tuple[Color, str]] = {
+    'extruder_target': ((245, 170, 170), 'temperature'),
+    'bed_target': ((170, 190, 245), 'temperature'),
+    'extruder': ((220, 30, 30), 'temperature'),
+    'bed': ((30, 80, 220), 'temperature'),
+    'fan': ((30, 160, 60), 'ratio'),
+    'speed': ((235, 140, 0), 'ratio'),
+}
+
+TEMPERATURE_GRID = 50
+RATIO_GRID = 0.25
+TIME_GRIDS = (60, 120, 300, 600, 900, 1800, 3600, 7200)
+
+
+# about 6-12 vertical grid lines per chart
+def time_grid(duration: float) -> int:
+    return next((step for step in TIME_GRIDS if duration / step <= 12), TIME_GRIDS[-1])
+
+
+# average per pixel column: None without samples, NaN (a gap in the line) with missing samples only
+def downsample(times: array, values: array, begin: float, duration: float, columns: int) -> List[Optional[float]]:
+    # samples are in chronological order, so a column is a slice between two bisected boundaries
+    step = duration / (columns - 1)
+    bounds = [bisect_left(times, begin + column * step) for column in range(columns + 1)]
+    result: List[Optional[float]] = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        if lo == hi:
+            result.append(None)
+            continue
+        chunk = values[lo:hi]
+        total = sum(chunk)
+        if total == total:
+            result.append(total / (hi - lo))
+            continue
+        # NaN in the slice, average the rest
+        present = [value for value in chunk if value == value]
+        result.append(sum(present) / len(present) if present else float('nan'))
+    return result
+
+
+class Canvas:
+    def __init__(self, width: int, height: int, background: Color = BACKGROUND) -> None:
+        self.width = width
+        self.height = height
+        self._pixels = bytearray(bytes(background) * (width * height))
+
+    def pixel(self, x: int, y: int, color: Color) -> None:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            offset = (y * self.width + x) * 3
+            self._pixels[offset:offset + 3] = bytes(color)
+
+    def hline(self, y: int, x0: int, x1: int, color: Color) -> None:
+        if 0 <= y < self.height:
+            x0, x1 = max(x0, 0), min(x1, self.width - 1)
+            offset = y * self.width * 3
+            self._pixels[offset + x0 * 3:offset + (x1 + 1) * 3] = bytes(color) * (x1 - x0 + 1)
+
+    def vline(self, x: int, y0: int, y1: int, color: Color) -> None:
+        for y in range(max(y0, 0), min(y1, self.height - 1) + 1):
+            self.pixel(x, y, color)
+
+    def line(self, x0: int, y0: int, x1: int, y1: int, color: Color, thickness: int = 2) -> None:
+        # Bresenham, thickened vertically
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            for offset in range(thickness):
+                self.pixel(x0, y0 + offset, color)
+            if x0 == x1 and y0 == y1:
+                break
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x0 += sx
+            if doubled <= dx:
+                error += dx
+                y0 += sy
+
+    def png(self) -> bytes:
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        stride = self.width * 3
+        # filter type 0 (none) per scanline
+        raw = b''.join(b'\x00' + self._pixels[y * stride:(y + 1) * stride] for y in range(self.height))
+        return (
+            b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b'')
+        )
+
+
+# temperatures on top, fan and speed (relative to its maximum) below; CPU bound, run it in an executor
+def render_chart(times: array, series: Dict[str, array], duration: float, end: float,
+                 width: int = 800, height: int = 480) -> bytes:
+    canvas = Canvas(width, height)
+    begin = end - duration
+    margin = 10
+    plot_width = width - 2 * margin
+    panels = {
+        'temperature': (margin, int(height * 0.68)),
+        'ratio': (int(height * 0.68) + 2 * margin, height - margin),
+    }
+
+    columns = {
+        name: downsample(times, series[name], begin, duration, plot_width) for name in COLORS if name in series
+    }
+
+    def present(values: List[Optional[float]]) -> List[float]:
+        return [value for value in values if value is not None and value == value]
+
+    temperatures = [value for name, (_, panel) in COLORS.items() if panel == 'temperature'
+                    for value in present(columns.get(name, []))]
+    temperature_max = max(TEMPERATURE_GRID, -(-max(temperatures, default=0) // TEMPERATURE_GRID) * TEMPERATURE_GRID)
+    speed_max = max(present(columns.get('speed', [])), default=0) or 1.0
+    scales = {'temperature': temperature_max, 'ratio': 1.0}
+
+    # grid
+    for panel, (top, bottom) in panels.items():
+        step = TEMPERATURE_GRID if panel == 'temperature' else RATIO_GRID
+        steps = int(round(scales[panel] / step))
+        for index in range(steps + 1):
+            y = bottom - int((bottom - top) * index / steps)
+            canvas.hline(y, margin, margin + plot_width - 1, AXIS if index == 0 else GRID)
+    grid = time_grid(duration)
+    mark = end - end % grid
+    while mark > begin:
+        x = margin + int((mark - begin) / duration * (plot_width - 1))
+        for top, bottom in panels.values():
+            canvas.vline(x, top, bottom - 1, GRID)
+        mark -= grid
+
+    # series, targets first so actual values are drawn over them
+    for name, values in columns.items():
+        color, panel = COLORS[name]
+        top, bottom = panels[panel]
+        scale = scales[panel] * (speed_max if name == 'speed' else 1.0)
+        previous = None
+        for column, value in enumerate(values):
+            if value is None:
+                # no samples in the column, connect neighbours
+                continue
+            if value != value:
+                previous = None
+                continue
+            point = (margin + column, bottom - int((bottom - top) * min(value / scale, 1.0)))
+            if previous is not None:
+                canvas.line(previous[0], previous[1], point[0], point[1], color)
+            previous = point
+
+    return canvas.png()
@@ -2,31 +2,202 @@ __all__ = ('config')
 
 from configparser import ConfigParser
 from dataclasses import dataclass, field
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from app.args_reader import args
 
+# printer names go into telegram callback data which is limited to 64 bytes
+MAX_PRINTER_NAME_SIZE = 16
+
 @dataclass
 class TelegramConfig:
     token: str = field(repr=False)
     chat_id: int = field(repr=False)
+    live_status: bool = False
+    mode: str = 'polling'
+    api_server: Optional[str] = None
+    webhook_url: Optional[str] = field(default=None, repr=False)
+    webhook_listen: str = '127.0.0.1:8443'
+    webhook_path: str = '/telegram'
+    webhook_secret: Optional[str] = field(default=None, repr=False)
 
 @dataclass
 class MoonrakerConfig:
     endpoint: str
     notification_events: List[str]
+    http_endpoint: Optional[str] = None
+    event_queue_size: int = 100
+    event_overflow: str = 'coalesce'
+    request_timeout: float = 30.0
+    gcode_timeout: float = 600.0
+    thumbnail_cache_size: int = 4
+    thumbnail_cache_dir: Optional[str] = None
+    thumbnail_cache_disk_size: int = 64
+    record_directory: Optional[str] = None
+    record_max_size: int = 16
+    record_files: int = 8
 
 @dataclass
 class WebcamConfig:
     input: str = None
     crf: int = 26
+    capture: str = 'auto'
+    capture_fps: float = 1.0
+    max_age: float = 1.0
+    idle_timeout: float = 300.0
+    video_buffer: float = 0.0
+    video_buffer_size: int = 16
+    video_segment: float = 1.0
+    video_profile: str = 'auto'
+    video_max_height: int = 720
+    video_max_fps: float = 15.0
+    video_max_size: float = 20.0
+    image_max_size: int = 1280
+    image_quality: int = 85
+    image_overlay: bool = False
+    image_thumbnail: bool = False
 
 @dataclass
-class Config:
-    telegram: TelegramConfig
+class TimelapseConfig:
+    enabled: bool = False
+    mode: str = 'layer'
+    interval: float = 10.0
+    fps: int = 25
+    crf: int = 23
+    directory: str = '/tmp/klipper-tg-bot-timelapse'
+
+@dataclass
+class TelemetryConfig:
+    enabled: bool = True
+    resolution: float = 5.0
+    history: float = 180.0
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = False
+    prometheus_host: str = '127.0.0.1'
+    prometheus_port: int = 0
+
+@dataclass
+class ChatConfig:
+    chat_id: int = field(repr=False)
+    events: List[str]
+    printers: Optional[List[str]] = None
+    commands: bool = True
+
+@dataclass
+class PrinterConfig:
+    name: str
     moonraker: MoonrakerConfig
     webcam: WebcamConfig
 
+@dataclass
+class Config:
+    telegram: TelegramConfig
+    chats: List[ChatConfig]
+    printers: List[PrinterConfig]
+    timelapse: TimelapseConfig
+    telemetry: TelemetryConfig
+    metrics: MetricsConfig
+
+def load_moonraker_config(parser: ConfigParser, section: str) -> MoonrakerConfig:
+    return MoonrakerConfig(
+        endpoint=parser.get(section, 'endpoint'),
+        notification_events=parser.get(section, 'notification_events', fallback='state,progress').split(','),
+        http_endpoint=parser.get(section, 'http_endpoint', fallback=None),
+        event_queue_size=int(parser.get(section, 'event_queue_size', fallback=100)),
+        event_overflow=parser.get(section, 'event_overflow', fallback='coalesce'),
+        request_timeout=float(parser.get(section, 'request_timeout', fallback=30.0)),
+        gcode_timeout=float(parser.get(section, 'gcode_timeout', fallback=600.0)),
+        thumbnail_cache_size=int(parser.get(section, 'thumbnail_cache_size', fallback=4)),
+        thumbnail_cache_dir=parser.get(section, 'thumbnail_cache_dir', fallback=None),
+        thumbnail_cache_disk_size=int(parser.get(section, 'thumbnail_cache_disk_size', fallback=64)),
+        record_directory=parser.get(section, 'record_directory', fallback=None),
+        record_max_size=int(parser.get(section, 'record_max_size', fallback=16)),
+        record_files=int(parser.get(section, 'record_files', fallback=8))
+    )
+
+def load_webcam_config(parser: ConfigParser, section: str) -> WebcamConfig:
+    return WebcamConfig(
+        input=parser.get(section, 'input', fallback=None),
+        crf=int(parser.get(section, 'crf', fallback=26)),
+        capture=parser.get(section, 'capture', fallback='auto'),
+        capture_fps=float(parser.get(section, 'capture_fps', fallback=1.0)),
+        max_age=float(parser.get(section, 'max_age', fallback=1.0)),
+        idle_timeout=float(parser.get(section, 'idle_timeout', fallback=300.0)),
+        video_buffer=float(parser.get(section, 'video_buffer', fallback=0.0)),
+        video_buffer_size=int(parser.get(section, 'video_buffer_size', fallback=16)),
+        video_segment=float(parser.get(section, 'video_segment', fallback=1.0)),
+        video_profile=parser.get(section, 'video_profile', fallback='auto'),
+        video_max_height=int(parser.get(section, 'video_max_height', fallback=720)),
+        video_max_fps=float(parser.get(section, 'video_max_fps', fallback=15.0)),
+        video_max_size=float(parser.get(section, 'video_max_size', fallback=20.0)),
+        image_max_size=int(parser.get(section, 'image_max_size', fallback=1280)),
+        image_quality=int(parser.get(section, 'image_quality', fallback=85)),
+        image_overlay=parser.getboolean(section, 'image_overlay', fallback=False),
+        image_thumbnail=parser.getboolean(section, 'image_thumbnail', fallback=False)
+    )
+
+def load_printers_config(parser: ConfigParser) -> List[PrinterConfig]:
+    # [printer:<name>] sections with optional [webcam:<name>] ones or single [moonraker] and [webcam] sections
+    printers = []
+    for section in parser.sections():
+        if not section.startswith('printer:'):
+            continue
+        name = section.split(':', 1)[1].strip()
+        printers.append(PrinterConfig(
+            name=name,
+            moonraker=load_moonraker_config(parser, section),
+            webcam=load_webcam_config(parser, f'webcam:{name}')
+        ))
+
+    if not printers:
+        printers.append(PrinterConfig(
+            name=parser.get('moonraker', 'name', fallback='printer'),
+            moonraker=load_moonraker_config(parser, 'moonraker'),
+            webcam=load_webcam_config(parser, 'webcam')
+        ))
+
+    for printer in printers:
+        if ':' in printer.name or len(printer.name.encode()) > MAX_PRINTER_NAME_SIZE:
+            raise ValueError(
+                f'bad printer name "{printer.name}", expected up to {MAX_PRINTER_NAME_SIZE} bytes without ":"'
+            )
+
+    return printers
+
+def load_chats_config(parser: ConfigParser) -> List[ChatConfig]:
+    # the chat of [telegram] section gets everything, [chat:<id>] sections add chats with their own filters
+    # or narrow down the [telegram] one
+    main = ChatConfig(
+        chat_id=int(parser.get('telegram', 'chat_id')),
+        events=parser.get('telegram', 'events', fallback='state,progress,messages,errors').split(',')
+    )
+    chats = [main]
+    seen = set()
+    for section in parser.sections():
+        if not section.startswith('chat:'):
+            continue
+        chat_id = int(section.split(':', 1)[1].strip())
+        if chat_id in seen:
+            raise ValueError(f'duplicate chat section for chat {chat_id}')
+        seen.add(chat_id)
+
+        printers = parser.get(section, 'printers', fallback=None)
+        if chat_id == main.chat_id:
+            main.events = parser.get(section, 'events', fallback=','.join(main.events)).split(',')
+            main.printers = printers.split(',') if printers else None
+            main.commands = parser.getboolean(section, 'commands', fallback=True)
+            continue
+        chats.append(ChatConfig(
+            chat_id=chat_id,
+            events=parser.get(section, 'events', fallback='state,progress,messages,errors').split(','),
+            printers=printers.split(',') if printers else None,
+            # added chats are notification only unless allowed explicitly
+            commands=parser.getboolean(section, 'commands', fallback=False)
+        ))
+    return chats
+
 def load_config() -> Config:
     parser = ConfigParser()
     parser.read(args.config)
@@ -34,15 +205,34 @@ def load_config() -> Config:
     config = Config(
         telegram=TelegramConfig(
             token=parser.get('telegram', 'token'),
-            chat_id=int(parser.get('telegram', 'chat_id'))
+            chat_id=int(parser.get('telegram', 'chat_id')),
+            live_status=parser.getboolean('telegram', 'live_status', fallback=False),
+            mode=parser.get('telegram', 'mode', fallback='polling'),
+            api_server=parser.get('telegram', 'api_server', fallback=None),
+            webhook_url=parser.get('telegram', 'webhook_url', fallback=None),
+            webhook_listen=parser.get('telegram', 'webhook_listen', fallback='127.0.0.1:8443'),
+            webhook_path=parser.get('telegram', 'webhook_path', fallback='/telegram'),
+            webhook_secret=parser.get('telegram', 'webhook_secret', fallback=None)
+        ),
+        chats=load_chats_config(parser),
+        printers=load_printers_config(parser),
+        timelapse=TimelapseConfig(
+            enabled=parser.getboolean('timelapse', 'enabled', fallback=False),
+            mode=parser.get('timelapse', 'mode', fallback='layer'),
+            interval=float(parser.get('timelapse', 'interval', fallback=10.0)),
+            fps=int(parser.get('timelapse', 'fps', fallback=25)),
+            crf=int(parser.get('timelapse', 'crf', fallback=23)),
+            directory=parser.get('timelapse', 'directory', fallback='/tmp/klipper-tg-bot-timelapse')
         ),
-        moonraker=MoonrakerConfig(
-            endpoint=parser.get('moonraker', 'endpoint'),
-            notification_events=parser.get('moonraker', 'notification_events', fallback='state,progress').split(',')
+        telemetry=TelemetryConfig(
+            enabled=parser.getboolean('telemetry', 'enabled', fallback=True),
+            resolution=float(parser.get('telemetry', 'resolution', fallback=5.0)),
+            history=float(parser.get('telemetry', 'history', fallback=180.0))
         ),
-        webcam=WebcamConfig(
-            input=parser.get('webcam', 'input', fallback=None),
-            crf=int(parser.get('webcam', 'crf', fallback=26))
+        metrics=MetricsConfig(
+            enabled=parser.getboolean('metrics', 'enabled', fallback=False),
+            prometheus_host=parser.get('metrics', 'prometheus_host', fallback='127.0.0.1'),
+            prometheus_port=int(parser.get('metrics', 'prometheus_port', fallback=0))
         )
     )
 
@@ -0,0 +1,118 @@
+import logging
+import asyncio
+
+from collections import deque
+from inspect import iscoroutinefunction
+from typing import Callable, Dict, List, Set, Deque, Tuple, Optional
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    __slots__ = ('callback', 'events', 'queue', 'wakeup', 'task')
+
+    def __init__(self, callback: Callable) -> None:
+        self.callback = callback
+        self.events: Set[str] = set()
+        # (event, args, emit time)
+        self.queue: Deque[Tuple[str, tuple, float]] = deque()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+# every listener gets its events in emit order, one at a time, from its own bounded queue;
+# callbacks run later than the emit, so emitters pass values as of the emit time
+class EventBus:
+    OVERFLOW_POLICIES = ('drop_oldest', 'coalesce')
+
+    def __init__(self, name: str, max_depth: int = 100, overflow: str = 'drop_oldest') -> None:
+        if overflow not in EventBus.OVERFLOW_POLICIES:
+            raise RuntimeError(f'unknown overflow policy "{overflow}"')
+        self._name = name
+        self._max_depth = max_depth
+        self._overflow = overflow
+        self._subscribers: List[Subscriber] = []
+        self._events: Dict[str, List[Subscriber]] = {}
+        self._closed = False
+        self._dispatch_latency = metrics.histogram('event_dispatch_latency_seconds', bus=name)
+        self._callback_time = metrics.histogram('event_callback_seconds', bus=name)
+
+    def add_listener(self, event: str, callback: Callable) -> None:
+        subscriber = next((s for s in self._subscribers if s.callback == callback), None)
+        if subscriber is None:
+            subscriber = Subscriber(callback)
+            self._subscribers.append(subscriber)
+        if event not in subscriber.events:
+            subscriber.events.add(event)
+            self._events.setdefault(event, []).append(subscriber)
+
+    def has_listeners(self, event: str) -> bool:
+        return event in self._events
+
+    def emit(self, event: str, *args) -> None:
+        if event not in self._events or self._closed:
+            return
+
+        for subscriber in self._events[event]:
+            self._enqueue(subscriber, event, args)
+            if subscriber.task is None or subscriber.task.done():
+                self._start(subscriber)
+            subscriber.wakeup.set()
+
+    async def close(self) -> None:
+        self._closed = True
+        tasks = [s.task for s in self._subscribers if s.task and not s.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for subscriber in self._subscribers:
+            subscriber.queue.clear()
+
+    def _enqueue(self, subscriber: Subscriber, event: str, args: tuple) -> None:
+        queue = subscriber.queue
+        if len(queue) >= self._max_depth:
+            dropped = None
+            if self._overflow == 'coalesce':
+                # the new event goes to the end, so events stay in emit order
+                dropped = next((item for item in queue if item[0] == event), None)
+                if dropped is not None:
+                    queue.remove(dropped)
+            if dropped is None:
+                dropped = queue.popleft()
+                logger.warning(f'{self._name}: listener queue is full, dropped event "{dropped[0]}"')
+        queue.append((event, args, metrics.now()))
+
+    def _start(self, subscriber: Subscriber) -> None:
+        if subscriber.wakeup is None:
+            subscriber.wakeup = asyncio.Event()
+        subscriber.task = asyncio.create_task(self._consumer_task(subscriber))
+        subscriber.task.add_done_callback(lambda task: self._supervise(subscriber, task))
+
+    def _supervise(self, subscriber: Subscriber, task: asyncio.Task) -> None:
+        if task.cancelled() or self._closed:
+            return
+        logger.error(f'{self._name}: listener task died ({task.exception()}), restarting')
+        if subscriber.queue:
+            self._start(subscriber)
+
+    async def _consumer_task(self, subscriber: Subscriber) -> None:
+        while True:
+            if not subscriber.queue:
+                subscriber.wakeup.clear()
+                await subscriber.wakeup.wait()
+                continue
+
+            event, args, emit_time = subscriber.queue.popleft()
+            self._dispatch_latency.observe_since(emit_time)
+            start = metrics.now()
+            try:
+                if iscoroutinefunction(subscriber.callback):
+                    await subscriber.callback(*args)
+                else:
+                    subscriber.callback(*args)
+            except Exception as e:
+                logger.error(f'{self._name}: got exception during invoke callback "{event}" ({e})')
+            self._callback_time.observe_since(start)
@@ -0,0 +1,140 @@
+import logging
+import asyncio
+import os
+
+from typing import Optional, Tuple, List, Iterator
+
+from app.config_reader import Config, PrinterConfig, TimelapseConfig, TelemetryConfig
+from app.moonraker import Moonraker
+from app.thumbnail_cache import ThumbnailCache
+from app.session_recorder import SessionRecorder
+from app.printer import Printer
+from app.webcam import Webcam
+from app.timelapse import Timelapse
+from app.telemetry import Telemetry
+from app.gcode_console import GcodeConsole
+from app.gcode_queue import GcodeQueue
+from app.image_pipeline import ImagePipeline
+from app.utils import create_status_text
+
+logger = logging.getLogger(__name__)
+
+
+class Machine:
+    def __init__(self, config: PrinterConfig, timelapse_config: TimelapseConfig,
+                 telemetry_config: TelemetryConfig) -> None:
+        self.name = config.name
+        self.config = config
+
+        thumbnail_cache_dir = None
+        if config.moonraker.thumbnail_cache_dir:
+            thumbnail_cache_dir = os.path.join(config.moonraker.thumbnail_cache_dir, config.name)
+
+        recorder = None
+        if config.moonraker.record_directory:
+            recorder = SessionRecorder(
+                directory=os.path.join(config.moonraker.record_directory, config.name),
+                max_size=config.moonraker.record_max_size * 1024 * 1024,
+                max_files=config.moonraker.record_files
+            )
+
+        self.moonraker = Moonraker(
+            endpoint=config.moonraker.endpoint,
+            http_endpoint=config.moonraker.http_endpoint,
+            event_queue_size=config.moonraker.event_queue_size,
+            event_overflow=config.moonraker.event_overflow,
+            request_timeout=config.moonraker.request_timeout,
+            gcode_timeout=config.moonraker.gcode_timeout,
+            thumbnail_cache=ThumbnailCache(
+                max_size=config.moonraker.thumbnail_cache_size * 1024 * 1024,
+                directory=thumbnail_cache_dir,
+                max_disk_size=config.moonraker.thumbnail_cache_disk_size * 1024 * 1024
+            ),
+            recorder=recorder
+        )
+        self.webcam = Webcam(config.webcam)
+        self.timelapse = Timelapse(timelapse_config, self.webcam, config.name)
+        self.telemetry = Telemetry(telemetry_config, self.moonraker)
+        self.console = GcodeConsole(self.moonraker)
+        self.gcode_queue = GcodeQueue(self.moonraker)
+        self.images = ImagePipeline(config.webcam)
+
+    @property
+    def printer(self) -> Printer:
+        return self.moonraker.printer
+
+    async def snapshot(self) -> Optional[bytes]:
+        image = await self.webcam.get_image()
+        if image is None:
+            return None
+        status = create_status_text(self.printer) if self.config.webcam.image_overlay else None
+        thumbnail = await self._file_thumbnail() if self.config.webcam.image_thumbnail else None
+        return await self.images.process(image, status, thumbnail)
+
+    async def _file_thumbnail(self) -> Optional[bytes]:
+        entry = self.moonraker.files.find(self.printer.data.print_stats.filename or '')
+        if entry is None:
+            return None
+        await self.moonraker.files.ensure_metadata(entry)
+        if entry.thumbnail is None:
+            return None
+        return await self.moonraker.get_thumbnail(entry.thumbnail, entry.modified)
+
+    async def open(self) -> None:
+        await self.moonraker.open()
+        await self.webcam.open()
+        if self.timelapse.fields():
+            await self.moonraker.require_fields('timelapse', self.timelapse.fields())
+        await self.telemetry.open()
+        await self.gcode_queue.open()
+
+    async def close(self) -> None:
+        await self.gcode_queue.close()
+        await self.telemetry.close()
+        await self.moonraker.close()
+        await self.timelapse.close()
+        await self.webcam.close()
+        self.images.close()
+
+
+class Farm:
+    def __init__(self, config: Config) -> None:
+        self._machines = {
+            printer_config.name: Machine(printer_config, config.timelapse, config.telemetry)
+            for printer_config in config.printers
+        }
+
+    def __iter__(self) -> Iterator[Machine]:
+        return iter(self._machines.values())
+
+    def __len__(self) -> int:
+        return len(self._machines)
+
+    def names(self) -> List[str]:
+        return list(self._machines.keys())
+
+    def get(self, name: str) -> Machine:
+        if name not in self._machines:
+            raise RuntimeError(f'unknown printer "{name}"')
+        return self._machines[name]
+
+    # printer named by the first word of args (may be omitted with a single printer) and the rest of args
+    def select(self, args: Optional[str]) -> Tuple[Machine, str]:
+        args = (args or '').strip()
+        parts = args.split(maxsplit=1)
+        if parts and parts[0] in self._machines:
+            return self._machines[parts[0]], parts[1] if len(parts) > 1 else ''
+        if len(self._machines) == 1:
+            return next(iter(self._machines.values())), args
+        raise RuntimeError(f'select printer: {", ".join(self.names())}')
+
+    def caption(self, machine: Machine, text: str) -> str:
+        if len(self._machines) == 1:
+            return text
+        return f'\N{Printer} <b>{machine.name}</b>\n{text}'
+
+    async def open(self) -> None:
+        await asyncio.gather(*[machine.open() for machine in self])
+
+    async def close(self) -> None:
+        await asyncio.gather(*[machine.close() for machine in self])
@@ -0,0 +1,213 @@
+import logging
+import asyncio
+
+from collections import deque
+from typing import Optional, List, Dict, Deque
+
+from app.moonraker_session import MoonrakerSession
+
+logger = logging.getLogger(__name__)
+
+
+class FileEntry:
+    __slots__ = ('id', 'path', 'modified', 'size', 'estimated_time', 'filament_total', 'thumbnail', 'has_metadata')
+
+    def __init__(self, id: int, path: str, modified: float, size: int) -> None:
+        self.id = id
+        self.path = path
+        self.modified = modified
+        self.size = size
+        self.estimated_time: Optional[float] = None
+        self.filament_total: Optional[float] = None
+        self.thumbnail: Optional[str] = None
+        self.has_metadata = False
+
+    def set_metadata(self, metadata: dict) -> None:
+        self.estimated_time = metadata.get('estimated_time')
+        self.filament_total = metadata.get('filament_total')
+        thumbnails = metadata.get('thumbnails') or []
+        if thumbnails:
+            # thumbnail paths are relative to the gcode file directory
+            directory = self.path.rpartition('/')[0]
+            relative_path = max(thumbnails, key=lambda t: t.get('width', 0))['relative_path']
+            self.thumbnail = f'{directory}/{relative_path}' if directory else relative_path
+        self.has_metadata = True
+
+
+# a reload keeps entries of unchanged files, so ids are stable for the lifetime of a file
+class FileIndex:
+    METADATA_BATCH_SIZE = 50
+
+    def __init__(self, session: MoonrakerSession) -> None:
+        self._session = session
+        self._entries: Dict[str, FileEntry] = {}
+        self._ids: Dict[int, FileEntry] = {}
+        self._next_id = 0
+        self._sorted: Optional[List[FileEntry]] = None
+        self._metadata_queue: Deque[FileEntry] = deque()
+        self._metadata_task = None
+        self._reload_task = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def load(self) -> None:
+        files = await self._session.request('server.files.list', {'root': 'gcodes'})
+
+        # older moonraker versions use "filename"
+        listed = {item.get('path', item.get('filename')): item for item in files}
+        for path in self._entries.keys() - listed.keys():
+            self._remove(path)
+        for path, item in listed.items():
+            self._put(path, item.get('modified', 0.0), item.get('size', 0))
+        logger.info(f'file index loaded ({len(self._entries)} files)')
+
+        self._queue_metadata([entry for entry in self._entries.values() if not entry.has_metadata])
+
+    async def close(self) -> None:
+        for task in (self._reload_task, self._metadata_task):
+            if task and not task.done():
+                task.cancel()
+        self._reload_task = None
+        self._metadata_task = None
+        self._metadata_queue.clear()
+
+    def get(self, id: int) -> Optional[FileEntry]:
+        return self._ids.get(id)
+
+    def find(self, path: str) -> Optional[FileEntry]:
+        return self._entries.get(path)
+
+    # prefix matches first, then substring ones, recent first
+    def search(self, query: str = '') -> List[FileEntry]:
+        if self._sorted is None:
+            self._sorted = sorted(self._entries.values(), key=lambda entry: entry.modified, reverse=True)
+        if not query:
+            return self._sorted
+
+        query = query.lower()
+        prefix_matches = []
+        substring_matches = []
+        for entry in self._sorted:
+            path = entry.path.lower()
+            if path.startswith(query) or path.rpartition('/')[2].startswith(query):
+                prefix_matches.append(entry)
+            elif query in path:
+                substring_matches.append(entry)
+        return prefix_matches + substring_matches
+
+    async def ensure_metadata(self, entry: FileEntry) -> None:
+        if entry.has_metadata:
+            return
+        try:
+            entry.set_metadata(await self._session.request('server.files.metadata', {'filename': entry.path}))
+        except Exception as e:
+            logger.warning(f'failed to get metadata of "{entry.path}" ({e})')
+
+    def update(self, params: dict) -> None:
+        action = params.get('action')
+        item = params.get('item') or {}
+        source_item = params.get('source_item') or {}
+        if item.get('root') != 'gcodes':
+            return
+
+        path = item.get('path', '')
+        if action in ('create_file', 'modify_file'):
+            entry = self._put(path, item.get('modified', 0.0), item.get('size', 0))
+            self._queue_metadata([entry])
+        elif action == 'delete_file':
+            self._remove(path)
+        elif action == 'move_file':
+            entry = self._remove(source_item.get('path', ''))
+            self._remove(path)
+            if entry is not None:
+                self._queue_metadata([self._rename(entry, path)])
+        elif action == 'delete_dir':
+            for entry in self._entries_in(path):
+                self._remove(entry.path)
+        elif action == 'move_dir':
+            source_path = source_item.get('path', '')
+            renamed = []
+            for entry in self._entries_in(source_path):
+                self._remove(entry.path)
+                renamed.append(self._rename(entry, path + entry.path[len(source_path):]))
+            self._queue_metadata(renamed)
+        elif action == 'root_update':
+            if self._reload_task and not self._reload_task.done():
+                self._reload_task.cancel()
+            self._reload_task = asyncio.create_task(self._reload())
+
+    def _entries_in(self, directory: str) -> List[FileEntry]:
+        prefix = directory.rstrip('/') + '/'
+        return [entry for path, entry in self._entries.items() if path.startswith(prefix)]
+
+    def _add(self, path: str, modified: float, size: int) -> FileEntry:
+        entry = FileEntry(self._next_id, path, modified, size)
+        self._next_id += 1
+        self._entries[path] = entry
+        self._ids[entry.id] = entry
+        self._sorted = None
+        return entry
+
+    def _put(self, path: str, modified: float, size: int) -> FileEntry:
+        # a changed file keeps its entry (and id), only its metadata is fetched again
+        entry = self._entries.get(path)
+        if entry is None:
+            return self._add(path, modified, size)
+        if entry.modified != modified:
+            self._entries[path] = entry = FileEntry(entry.id, path, modified, size)
+            self._ids[entry.id] = entry
+            self._sorted = None
+        entry.size = size
+        return entry
+
+    def _remove(self, path: str) -> Optional[FileEntry]:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            del self._ids[entry.id]
+            self._sorted = None
+        return entry
+
+    def _rename(self, entry: FileEntry, path: str) -> FileEntry:
+        renamed = self._add(path, entry.modified, entry.size)
+        renamed.estimated_time = entry.estimated_time
+        renamed.filament_total = entry.filament_total
+        # thumbnail path depends on file name, so it'll be fetched again
+        renamed.has_metadata = False
+        return renamed
+
+    async def _reload(self) -> None:
+        try:
+            await self.load()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f'failed to reload file index ({e})')
+
+    def _queue_metadata(self, entries: List[FileEntry]) -> None:
+        self._metadata_queue.extend(entries)
+        if self._metadata_queue and (not self._metadata_task or self._metadata_task.done()):
+            self._metadata_task = asyncio.create_task(self._load_metadata())
+
+    async def _load_metadata(self) -> None:
+        try:
+            while self._metadata_queue:
+                batch = {}
+                while self._metadata_queue and len(batch) < FileIndex.METADATA_BATCH_SIZE:
+                    entry = self._metadata_queue.popleft()
+                    # skip entries replaced or removed since queued
+                    if not entry.has_metadata and self._entries.get(entry.path) is entry:
+                        batch[entry.id] = entry
+                if not batch:
+                    continue
+                entries = list(batch.values())
+                results = await self._session.request_batch(
+                    [('server.files.metadata', {'filename': entry.path}) for entry in entries], raise_errors=False
+                )
+                for entry, result in zip(entries, results):
+                    if not isinstance(result, Exception):
+                        entry.set_metadata(result)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f'failed to load file metadata ({e})')
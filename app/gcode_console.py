@@ -0,0 +1,116 @@
+import logging
+import asyncio
+
+from html import escape
+from typing import Optional, List, Dict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from app.moonraker import Moonraker
+from app.outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+
+# edits are keyed by message in the outbox, a full message is continued in a new one up to MAX_MESSAGES,
+# then the oldest lines are dropped
+class ConsoleStream:
+    # telegram limit is 4096 characters, the rest is left for the title, footer and skipped lines marker
+    MESSAGE_LENGTH = 3800
+    MAX_MESSAGES = 4
+    MAX_TITLE_LENGTH = 100
+    RUNNING_FOOTER = '\N{SLEEPING SYMBOL}...'
+
+    def __init__(self, bot: Bot, outbox: Outbox, chat_id: int, message_id: int, title: str) -> None:
+        self._bot = bot
+        self._outbox = outbox
+        self._chat_id = chat_id
+        self._title = title if len(title) <= ConsoleStream.MAX_TITLE_LENGTH else \
+            title[:ConsoleStream.MAX_TITLE_LENGTH - 1] + '\N{Horizontal Ellipsis}'
+        self._pages: List[List[str]] = [[]]
+        self._lengths = [0]
+        self._message_ids: List[Optional[int]] = [message_id]
+        self._skipped = 0
+        self._footer = ConsoleStream.RUNNING_FOOTER
+
+    def append(self, response: str) -> None:
+        if len(response) > ConsoleStream.MESSAGE_LENGTH:
+            response = response[:ConsoleStream.MESSAGE_LENGTH - 1] + '\N{Horizontal Ellipsis}'
+        length = len(response) + 1
+
+        if self._lengths[-1] + length > ConsoleStream.MESSAGE_LENGTH:
+            if len(self._pages) < ConsoleStream.MAX_MESSAGES:
+                # the full page loses its footer
+                self._schedule(len(self._pages) - 1)
+                self._pages.append([])
+                self._lengths.append(0)
+                self._message_ids.append(None)
+            else:
+                page = self._pages[-1]
+                while page and self._lengths[-1] + length > ConsoleStream.MESSAGE_LENGTH:
+                    self._lengths[-1] -= len(page.pop(0)) + 1
+                    self._skipped += 1
+
+        self._pages[-1].append(response)
+        self._lengths[-1] += length
+        self._schedule(len(self._pages) - 1)
+
+    async def finish(self, footer: str) -> None:
+        self._footer = footer
+        await self._schedule(len(self._pages) - 1)
+
+    def _schedule(self, page: int) -> asyncio.Future:
+        # a queued edit of the page is replaced, the text is rendered when the edit goes out
+        return self._outbox.send(
+            self._chat_id, lambda: self._send_page(page), key=f'console:{self._message_ids[0]}:{page}'
+        )
+
+    def _render(self, page: int) -> str:
+        parts = []
+        if page == 0:
+            parts.append(f'<code>{escape(self._title)}</code>')
+        last = page == len(self._pages) - 1
+        if last and self._skipped:
+            parts.append(f'<i>\N{Horizontal Ellipsis} {self._skipped} lines skipped</i>')
+        if self._pages[page]:
+            lines = '\n'.join(self._pages[page])
+            parts.append(f'<pre>{escape(lines)}</pre>')
+        if last:
+            parts.append(self._footer)
+        return '\n'.join(parts)
+
+    async def _send_page(self, page: int) -> None:
+        text = self._render(page)
+        message_id = self._message_ids[page]
+        if message_id is None:
+            message = await self._bot.send_message(chat_id=self._chat_id, text=text)
+            self._message_ids[page] = message.message_id
+            return
+
+        try:
+            await self._bot.edit_message_text(text=text, chat_id=self._chat_id, message_id=message_id)
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in e.message:
+                raise
+
+
+class GcodeConsole:
+    # responses are queued behind the script result, keep collecting a bit after it
+    LINGER = 1.0
+
+    def __init__(self, moonraker: Moonraker) -> None:
+        self._streams: Dict[int, ConsoleStream] = {}
+        moonraker.add_gcode_listener(self._on_response)
+
+    # replaces a previous stream of the chat
+    def attach(self, chat_id: int, stream: ConsoleStream) -> None:
+        self._streams[chat_id] = stream
+
+    def detach(self, chat_id: int, stream: ConsoleStream) -> None:
+        if self._streams.get(chat_id) is stream:
+            del self._streams[chat_id]
+
+    def _on_response(self, response: str) -> None:
+        for stream in self._streams.values():
+            stream.append(response)
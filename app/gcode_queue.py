@@ -0,0 +1,151 @@
+import logging
+import asyncio
+
+from collections import deque
+from typing import Optional, Deque, Dict, List, Callable
+
+from app.moonraker import Moonraker
+
+logger = logging.getLogger(__name__)
+
+
+# called with the failed command (script or move) and the error
+ErrorCallback = Callable[[str, Exception], None]
+
+
+class QueuedCommand:
+    __slots__ = ('script', 'axis', 'distance', 'time', 'error_callbacks')
+
+    def __init__(self, script: Optional[str], axis: Optional[str], distance: float, time: float,
+                 on_error: Optional[ErrorCallback]) -> None:
+        self.script = script
+        self.axis = axis
+        self.distance = distance
+        self.time = time
+        self.error_callbacks: List[ErrorCallback] = [on_error] if on_error else []
+
+    def describe(self) -> str:
+        return self.script if self.axis is None else f'G1 {self.axis}{self.distance:+g}'
+
+
+# scripts run one at a time in order, jog taps along the same axis within JOG_WINDOW merge into one move
+class GcodeQueue:
+    JOG_WINDOW = 0.4
+    AXES = 'XYZ'
+    STATE_NAME = 'TELEGRAM_BOT_JOG'
+    # position changes on every move, it's subscribed only while the toolbox is in use
+    FIELDS = {'gcode_move': ['gcode_position']}
+    POSITION_TIMEOUT = 600.0
+
+    def __init__(self, moonraker: Moonraker) -> None:
+        self._moonraker = moonraker
+        self._commands: Deque[QueuedCommand] = deque()
+        # distance of queued and running jogs per axis
+        self._offsets: Dict[str, float] = {axis: 0.0 for axis in GcodeQueue.AXES}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._release_task = None
+
+    async def open(self) -> None:
+        self._task = asyncio.create_task(self._loop_task())
+
+    async def close(self) -> None:
+        for task in (self._task, self._release_task):
+            if task and not task.done():
+                task.cancel()
+                await task
+        self._task = None
+        self._release_task = None
+        self._commands.clear()
+
+    async def track_position(self) -> None:
+        if self._release_task and not self._release_task.done():
+            self._release_task.cancel()
+        self._release_task = asyncio.create_task(self._release_position_task())
+        await self._moonraker.require_fields('toolbox', GcodeQueue.FIELDS)
+
+    def script(self, script: str, on_error: Optional[ErrorCallback] = None) -> None:
+        self._push(QueuedCommand(script, None, 0.0, asyncio.get_running_loop().time(), on_error))
+
+    # returns the axis position after all queued moves (None if unknown)
+    def jog(self, axis: str, distance: float, on_error: Optional[ErrorCallback] = None) -> Optional[float]:
+        if axis not in GcodeQueue.AXES:
+            raise ValueError(f'unknown axis "{axis}"')
+        now = asyncio.get_running_loop().time()
+        self._offsets[axis] += distance
+
+        last = self._commands[-1] if self._commands else None
+        if last is not None and last.axis == axis and now - last.time <= GcodeQueue.JOG_WINDOW:
+            last.distance += distance
+            last.time = now
+            if on_error:
+                last.error_callbacks.append(on_error)
+        else:
+            self._push(QueuedCommand(None, axis, distance, now, on_error))
+        return self.queued_position(axis)
+
+    def queued_position(self, axis: str) -> Optional[float]:
+        position = self._moonraker.printer.data.gcode_move.gcode_position
+        if position is None:
+            return None
+        return position[GcodeQueue.AXES.index(axis)] + self._offsets[axis]
+
+    def _push(self, command: QueuedCommand) -> None:
+        self._commands.append(command)
+        self._wakeup.set()
+
+    def _make_script(self, command: QueuedCommand) -> Optional[str]:
+        if command.axis is None:
+            return command.script
+        if command.distance == 0:
+            # taps cancelled each other out
+            return None
+        return '\n'.join([
+            f'SAVE_GCODE_STATE NAME={GcodeQueue.STATE_NAME}',
+            'G91',
+            f'G1 {command.axis}{command.distance:g}',
+            f'RESTORE_GCODE_STATE NAME={GcodeQueue.STATE_NAME}'
+        ])
+
+    async def _release_position_task(self) -> None:
+        try:
+            await asyncio.sleep(GcodeQueue.POSITION_TIMEOUT)
+            await self._moonraker.release_fields('toolbox')
+        except asyncio.CancelledError:
+            pass
+
+    async def _loop_task(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+            while True:
+                if not self._commands:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                command = self._commands[0]
+                if command.axis is not None:
+                    # wait for more taps to merge
+                    delay = command.time + GcodeQueue.JOG_WINDOW - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        continue
+                self._commands.popleft()
+
+                script = self._make_script(command)
+                try:
+                    if script is not None:
+                        await self._moonraker.gcode_script(script)
+                except Exception as e:
+                    logger.error(f'failed to run queued gcode ({e})')
+                    for callback in command.error_callbacks:
+                        try:
+                            callback(command.describe(), e)
+                        except Exception:
+                            logger.exception('exception in gcode error callback')
+                finally:
+                    if command.axis is not None:
+                        self._offsets[command.axis] -= command.distance
+
+        except asyncio.CancelledError:
+            pass
@@ -9,8 +9,11 @@ commands = [
     BotCommand(command='gcode', description='excecute gcode'),
     BotCommand(command='video', description='capture few seconds video'),
     BotCommand(command='last', description='show last print job status'),
+    BotCommand(command='chart', description='show temperature chart'),
+    BotCommand(command='files', description='browse, search and print gcode files'),
     BotCommand(command='toolbox', description='show control toolbox'),
     BotCommand(command='emergency_stop', description='emergency printer stop'),
+    BotCommand(command='metrics', description='show bot performance metrics'),
     BotCommand(command='help', description='show help'),
 ]
 
@@ -21,18 +24,22 @@ async def handler_command_help(message: Message):
     help_message = ''.join(
         f'/{command.command} - {command.description}\n' for command in commands
     )
+    help_message += '\nwith several printers put printer name after a command, e.g. <code>/status voron</code>\n'
     await message.answer(help_message)
 
 def setup_router() -> Router:
-    from . import status, gcode, video, last, toolbox, emergency_stop
+    from . import status, gcode, video, last, chart, files, toolbox, emergency_stop, metrics
 
     main_router = Router()
     main_router.include_router(status.router)
     main_router.include_router(gcode.router)
     main_router.include_router(video.router)
     main_router.include_router(last.router)
+    main_router.include_router(chart.router)
+    main_router.include_router(files.router)
     main_router.include_router(toolbox.router)
     main_router.include_router(emergency_stop.router)
+    main_router.include_router(metrics.router)
     main_router.include_router(router)
 
     return main_router
@@ -0,0 +1,52 @@
+import logging
+import asyncio
+import time
+
+from aiogram import Router
+from aiogram.types import Message, BufferedInputFile
+from aiogram.filters import Command, CommandObject
+
+from app.farm import Farm
+from app.chart import render_chart, time_grid, TEMPERATURE_GRID
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+DEFAULT_MINUTES = 30
+
+@router.message(Command('chart'))
+async def handler_command_chart(message: Message, command: CommandObject, farm: Farm):
+    notification_message = await message.answer('\N{SLEEPING SYMBOL}...')
+    try:
+        machine, args = farm.select(command.args)
+        minutes = float(args) if args else DEFAULT_MINUTES
+        if minutes <= 0:
+            raise RuntimeError('minutes should be positive')
+
+        duration = minutes * 60
+        times, series = machine.telemetry.series(duration)
+        if not times:
+            raise RuntimeError('no telemetry recorded yet')
+
+        # rendering is CPU bound, keep it away from the event loop
+        image = await asyncio.get_running_loop().run_in_executor(
+            None, render_chart, times, series, duration, time.time()
+        )
+
+        data = machine.printer.data
+        text = (
+            f'\N{Chart with Upwards Trend} last {minutes:g} min, grid {TEMPERATURE_GRID}\N{Degree Celsius} '
+            f'/ {time_grid(duration) // 60} min\n'
+            f'\N{Large Red Circle} extruder <b>{data.extruder.get("temperature", 0):.1f}</b>\N{Degree Celsius}'
+            f' ({data.extruder.get("target", 0):.0f}\N{Degree Celsius})\n'
+            f'\N{Large Blue Circle} bed <b>{data.heater_bed.get("temperature", 0):.1f}</b>\N{Degree Celsius}'
+            f' ({data.heater_bed.get("target", 0):.0f}\N{Degree Celsius})\n'
+            f'\N{Large Green Circle} fan <b>{data.fan.get("speed", 0) * 100:.0f}%</b>\n'
+            f'\N{Large Orange Circle} speed <b>{data.gcode_move.get("speed", 0) / 60:.0f}mm/s</b> (relative)\n'
+        )
+        await message.reply_photo(BufferedInputFile(image, 'chart.png'), caption=farm.caption(machine, text))
+    except Exception as ex:
+        await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+        logger.exception(f'exception during process message {message}')
+    finally:
+        await notification_message.delete()
@@ -2,46 +2,55 @@ import logging
 
 from aiogram import Router
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.filters.callback_data import CallbackData
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
 
-from app.moonraker import Moonraker
+from app.farm import Farm
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 class EmergencyStopCallback(CallbackData, prefix='es'):
+    printer: str
     action: str
 
-def make_confirmation_keyboard() -> InlineKeyboardMarkup:
+def make_confirmation_keyboard(printer: str) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(
         text='Confirm',
-        callback_data=EmergencyStopCallback(action='confirm')
+        callback_data=EmergencyStopCallback(printer=printer, action='confirm')
     )
     builder.button(
         text='Cancel',
-        callback_data=EmergencyStopCallback(action='cancel')
+        callback_data=EmergencyStopCallback(printer=printer, action='cancel')
     )
     return builder.as_markup()
 
 @router.callback_query(EmergencyStopCallback.filter())
-async def callback_emergency_stop(callback: CallbackQuery, callback_data: EmergencyStopCallback, moonraker: Moonraker):
-    await callback.answer()
-
-    message = callback.message.reply_to_message
-    await callback.message.delete()
-
+async def callback_emergency_stop(callback: CallbackQuery, callback_data: EmergencyStopCallback, farm: Farm):
+    # stop the printer before any telegram request
     try:
         if callback_data.action == 'confirm':
-            await moonraker.emergency_stop()
-            await message.reply('done')
+            await farm.get(callback_data.printer).moonraker.emergency_stop()
+            text = 'done'
         else:
-            await message.reply('cancelled')
+            text = 'cancelled'
     except Exception as ex:
-        await message.edit_text(f'\N{Heavy Ballot X} error: {ex}')
+        text = f'\N{Heavy Ballot X} error: {ex}'
+
+    await callback.answer()
+    message = callback.message.reply_to_message
+    await callback.message.delete()
+    await message.reply(text)
 
 @router.message(Command('emergency_stop'))
-async def handler_command_emergency_stop(message: Message, moonraker: Moonraker):
-    await message.reply('are you shure?', reply_markup=make_confirmation_keyboard())
+async def handler_command_emergency_stop(message: Message, command: CommandObject, farm: Farm):
+    try:
+        machine, _ = farm.select(command.args)
+        await message.reply(
+            farm.caption(machine, 'are you shure?'), reply_markup=make_confirmation_keyboard(machine.name)
+        )
+    except Exception as ex:
+        await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+        logger.exception(f'exception during process message {message}')
@@ -0,0 +1,153 @@
+import logging
+
+from html import escape
+from typing import Tuple, Optional
+
+from aiogram import Router
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.filters import Command, CommandObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
+
+from app.farm import Farm, Machine
+from app.file_index import FileEntry
+from app.utils import format_time, format_fillament_length
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+PAGE_SIZE = 8
+# callback data is limited to 64 bytes, the query takes what the longest callback leaves free
+MAX_CALLBACK_DATA = 64
+MAX_PAGE = 9999
+MAX_FILE_ID = 9999999
+
+class FilesCallback(CallbackData, prefix='fl'):
+    printer: str
+    action: str
+    page: int = 0
+    file_id: int = -1
+    # an empty query is unpacked as None
+    query: Optional[str] = None
+
+def fit_query(printer: str, query: str) -> str:
+    query = query.replace(FilesCallback.__separator__, '')
+    longest = max(
+        len(FilesCallback(printer=printer, action='select', page=MAX_PAGE, file_id=MAX_FILE_ID).pack().encode()),
+        len(FilesCallback(printer=printer, action='page', page=MAX_PAGE, file_id=MAX_FILE_ID).pack().encode())
+    )
+    free = max(0, MAX_CALLBACK_DATA - longest)
+    return query.encode()[:free].decode(errors='ignore')
+
+def format_entry(entry: FileEntry) -> str:
+    text = f'<b>{escape(entry.path)}</b>'
+    details = []
+    if entry.estimated_time:
+        details.append(f'\N{Stopwatch} {format_time(entry.estimated_time)}')
+    if entry.filament_total:
+        details.append(f'\N{Straight Ruler} {format_fillament_length(entry.filament_total)}')
+    if details:
+        text += f'\n    {"  ".join(details)}'
+    return text
+
+def make_files_page(farm: Farm, machine: Machine, query: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    entries = machine.moonraker.files.search(query)
+    pages = max(1, (len(entries) + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    page_entries = entries[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+    title = f'\N{Card Index Dividers} files matching "{escape(query)}"' if query else '\N{Card Index Dividers} files'
+    if page_entries:
+        lines = '\n'.join(f'{number}. {format_entry(entry)}' for number, entry in enumerate(page_entries, 1))
+        text = f'{title} ({len(entries)}, page {page + 1}/{pages})\n\n{lines}'
+    else:
+        text = f'{title}\n\nno files'
+
+    builder = InlineKeyboardBuilder()
+    for number, entry in enumerate(page_entries, 1):
+        builder.button(
+            text=str(number),
+            callback_data=FilesCallback(printer=machine.name, action='select', file_id=entry.id, query=query)
+        )
+    navigation = []
+    if page > 0:
+        navigation.append(('\N{Black Left-Pointing Triangle}', page - 1))
+    if page < pages - 1:
+        navigation.append(('\N{Black Right-Pointing Triangle}', page + 1))
+    for label, target in navigation:
+        builder.button(
+            text=label,
+            callback_data=FilesCallback(printer=machine.name, action='page', page=target, query=query)
+        )
+    builder.adjust(*([4] * ((len(page_entries) + 3) // 4)), 2)
+    return farm.caption(machine, text), builder.as_markup()
+
+def make_print_keyboard(printer: str, file_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text='\N{Black Right-Pointing Triangle} Start print',
+        callback_data=FilesCallback(printer=printer, action='print', file_id=file_id)
+    )
+    builder.button(
+        text='\N{Heavy Ballot X} Cancel',
+        callback_data=FilesCallback(printer=printer, action='cancel', file_id=file_id)
+    )
+    return builder.as_markup()
+
+async def send_file_details(message: Message, farm: Farm, machine: Machine, entry: FileEntry) -> None:
+    await machine.moonraker.files.ensure_metadata(entry)
+    text = farm.caption(machine, f'\N{Memo} {format_entry(entry)}\n\nstart printing?')
+    keyboard = make_print_keyboard(machine.name, entry.id)
+
+    image = None
+    if entry.thumbnail:
+        image = await machine.moonraker.get_thumbnail(entry.thumbnail, entry.modified)
+    if image:
+        await message.answer_photo(BufferedInputFile(image, 'thumbnail.png'), caption=text, reply_markup=keyboard)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+
+@router.message(Command('files'))
+async def handler_command_files(message: Message, command: CommandObject, farm: Farm):
+    try:
+        machine, query = farm.select(command.args)
+        query = fit_query(machine.name, query)
+        text, keyboard = make_files_page(farm, machine, query, 0)
+        await message.answer(text, reply_markup=keyboard)
+    except Exception as ex:
+        await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+        logger.exception(f'exception during process message {message}')
+
+@router.callback_query(FilesCallback.filter())
+async def callback_files(callback: CallbackQuery, callback_data: FilesCallback, farm: Farm):
+    try:
+        machine = farm.get(callback_data.printer)
+        if callback_data.action == 'page':
+            text, keyboard = make_files_page(farm, machine, callback_data.query or '', callback_data.page)
+            await callback.message.edit_text(text, reply_markup=keyboard)
+            await callback.answer()
+            return
+
+        if callback_data.action == 'cancel':
+            await callback.message.delete()
+            await callback.answer()
+            return
+
+        entry = machine.moonraker.files.get(callback_data.file_id)
+        if entry is None:
+            await callback.answer(text='file was changed or removed, run /files again', show_alert=True)
+            return
+
+        if callback_data.action == 'select':
+            await send_file_details(callback.message, farm, machine, entry)
+            await callback.answer()
+        elif callback_data.action == 'print':
+            if machine.printer.state in ('printing', 'paused'):
+                await callback.answer(text=f'printer is {machine.printer.state}', show_alert=True)
+                return
+            await machine.moonraker.print_start(entry.path)
+            await callback.message.edit_reply_markup(reply_markup=None)
+            await callback.answer(text=f'started {entry.path}')
+    except Exception as ex:
+        await callback.answer(text=f'error: {ex}', show_alert=True)
+        logger.exception(f'exception during process callback {callback_data}')
@@ -1,25 +1,37 @@
 import logging
+import asyncio
 
 from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import Command, CommandObject
 
-from app.moonraker import Moonraker
+from app.farm import Farm
+from app.outbox import Outbox
+from app.gcode_console import ConsoleStream, GcodeConsole
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 @router.message(Command('gcode'))
-async def handler_command_gcode(message: Message, command: CommandObject, moonraker: Moonraker):
-    notification_message = await message.answer('\N{SLEEPING SYMBOL}...')
+async def handler_command_gcode(message: Message, command: CommandObject, farm: Farm, outbox: Outbox):
+    # the reply becomes the console: gcode responses are streamed into it while the script runs
+    console_message = await message.reply('\N{SLEEPING SYMBOL}...')
+    stream = None
     try:
-        script = command.args or ''
+        machine, script = farm.select(command.args)
         if script == '':
             raise RuntimeError('empty script')
-        await moonraker.gcode_script(script)
-        await message.reply('done')
+        stream = ConsoleStream(message.bot, outbox, message.chat.id, console_message.message_id, script)
+        machine.console.attach(message.chat.id, stream)
+        try:
+            await machine.moonraker.gcode_script(script)
+            await asyncio.sleep(GcodeConsole.LINGER)
+        finally:
+            machine.console.detach(message.chat.id, stream)
+        await stream.finish('\N{Heavy Check Mark} done')
     except Exception as ex:
-        await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+        if stream is not None:
+            await stream.finish(f'\N{Heavy Ballot X} error: {ex}')
+        else:
+            await console_message.edit_text(f'\N{Heavy Ballot X} error: {ex}')
         logger.exception(f'exception during process message {message}')
-    finally:
-        await notification_message.delete()
@@ -2,33 +2,36 @@ import logging
 
 from aiogram import Router
 from aiogram.types import Message, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
-from app.moonraker import Moonraker
+from app.farm import Farm
 from app.utils import format_time
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 @router.message(Command('last'))
-async def handler_command_last(message: Message, moonraker: Moonraker):
+async def handler_command_last(message: Message, command: CommandObject, farm: Farm):
     notification_message = await message.answer('\N{SLEEPING SYMBOL}...')
     try:
-        data = await moonraker.history_list(limit=1, order='desc')
+        machine, _ = farm.select(command.args)
+        data = await machine.moonraker.history_list(limit=1, order='desc')
         jobs = data['jobs']
         if not jobs:
             await message.reply('no jobs')
         else:
             job = jobs[0]
-            text = (
+            text = farm.caption(machine, (
                 f'\N{Memo} <i>filename:</i> <b>{job["filename"]}</b>\n'
                 f'\N{White Heavy Check Mark} <i>status:</i> <b>{job["status"]}</b>\n'
                 f'\N{Stopwatch} <i>print duration:</i> <b>{format_time(job["print_duration"])}</b>\n'
-            )
+            ))
 
             thumbnails = job['metadata']['thumbnails']
             if thumbnails:
-                image = await moonraker.get_thumbnail(thumbnails[-1]['relative_path'])
+                image = await machine.moonraker.get_thumbnail(
+                    thumbnails[-1]['relative_path'], job['metadata'].get('modified')
+                )
                 if image:
                     await message.reply_photo(BufferedInputFile(image, thumbnails[-1]['relative_path']), caption=text)
                 else:
@@ -0,0 +1,37 @@
+import logging
+
+from html import escape
+
+from aiogram import Router
+from aiogram.types import Message
+from aiogram.filters import Command
+
+from app.farm import Farm
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+# fits telegram message length limit with some room for escaping
+MAX_SUMMARY_LENGTH = 3500
+
+@router.message(Command('metrics'))
+async def handler_command_metrics(message: Message, farm: Farm):
+    try:
+        if not metrics.enabled:
+            await message.reply(
+                'metrics are disabled, set <code>enabled = true</code> in <code>[metrics]</code> section'
+            )
+            return
+
+        requests = '\n'.join(
+            f'{machine.name}: {", ".join(f"{key} {value:.3g}" for key, value in machine.moonraker.stats().items())}'
+            for machine in farm
+        )
+        summary = f'{metrics.summary()}\n\n{requests}'
+        if len(summary) > MAX_SUMMARY_LENGTH:
+            summary = summary[:MAX_SUMMARY_LENGTH] + '...'
+        await message.reply(f'\N{Bar Chart} <b>metrics</b>\n<pre>{escape(summary)}</pre>')
+    except Exception as ex:
+        await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+        logger.exception(f'exception during process message {message}')
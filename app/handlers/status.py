@@ -2,28 +2,40 @@ import logging
 
 from aiogram import Router
 from aiogram.types import Message, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
-from app.moonraker import Moonraker
+from app.farm import Farm, Machine
 from app.utils import create_status_text
-from app.webcam import get_webcam_image
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+async def reply_status(message: Message, farm: Farm, machine: Machine) -> None:
+    if not machine.moonraker.online():
+        raise RuntimeError(f'moonraker of "{machine.name}" not connected')
+
+    text = farm.caption(machine, create_status_text(machine.printer))
+    image = await machine.snapshot()
+    if image is not None:
+        await message.reply_photo(BufferedInputFile(image, 'live_view.jpg'), caption=text)
+    else:
+        await message.reply(text)
+
 @router.message(Command('status'))
-async def handler_command_status(message: Message, moonraker: Moonraker):
+async def handler_command_status(message: Message, command: CommandObject, farm: Farm):
     notification_message = await message.answer('\N{SLEEPING SYMBOL}...')
     try:
-        if not moonraker.online():
-            raise RuntimeError('moonraker not connected')
-
-        text = create_status_text(moonraker.printer)
-        image = await get_webcam_image()
-        if image is not None:
-            await message.reply_photo(BufferedInputFile(image, 'live_view.png'), caption=text)
+        if command.args:
+            machines = [farm.select(command.args)[0]]
         else:
-            await message.reply(text)
+            machines = list(farm)
+
+        for machine in machines:
+            try:
+                await reply_status(message, farm, machine)
+            except Exception as ex:
+                await message.reply(f'\N{Heavy Ballot X} error: {ex}')
+                logger.exception(f'exception during process message {message}')
     except Exception as ex:
         await message.reply(f'\N{Heavy Ballot X} error: {ex}')
         logger.exception(f'exception during process message {message}')
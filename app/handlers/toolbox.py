@@ -1,68 +1,101 @@
 import logging
 
+from html import escape
+from typing import Optional
+
 from aiogram import Router
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.filters.callback_data import CallbackData
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
 
-from app.moonraker import Moonraker
+from app.farm import Farm
+from app.outbox import Outbox
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 class ToolboxCallback(CallbackData, prefix='tb'):
-    gcode: str
+    printer: str
+    # empty values are unpacked as None
+    gcode: Optional[str] = None
+    axis: Optional[str] = None
+    distance: float = 0
 
-def make_toolbox_keyboard(distance: int = 50) -> InlineKeyboardMarkup:
-    def relative_before(gcode: str) -> str:
-        return '\n'.join(['G91', gcode])
+def make_toolbox_keyboard(printer: str, distance: int = 50) -> InlineKeyboardMarkup:
+    def jog(axis: str, direction: int) -> ToolboxCallback:
+        return ToolboxCallback(printer=printer, axis=axis, distance=direction * distance)
 
     builder = InlineKeyboardBuilder()
     builder.button(
         text='Home All',
-        callback_data=ToolboxCallback(gcode='G28')
+        callback_data=ToolboxCallback(printer=printer, gcode='G28')
     )
     builder.button(
         text='Y+',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 Y{distance}'))
+        callback_data=jog('Y', 1)
     )
     builder.button(
         text='Home XY',
-        callback_data=ToolboxCallback(gcode='G28 X Y')
+        callback_data=ToolboxCallback(printer=printer, gcode='G28 X Y')
     )
     builder.button(
         text='Z+',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 Z{distance}'))
+        callback_data=jog('Z', 1)
     )
     builder.button(
         text='X-',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 X-{distance}'))
+        callback_data=jog('X', -1)
     )
     builder.button(
         text='Y-',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 Y-{distance}'))
+        callback_data=jog('Y', -1)
     )
     builder.button(
         text='X+',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 X{distance}'))
+        callback_data=jog('X', 1)
     )
     builder.button(
         text='Z-',
-        callback_data=ToolboxCallback(gcode=relative_before(f'G1 Z-{distance}'))
+        callback_data=jog('Z', -1)
     )
     builder.adjust(4)
     return builder.as_markup(resize_keyboard=True)
 
 @router.callback_query(ToolboxCallback.filter())
-async def callback_toolbox(callback: CallbackQuery, callback_data: ToolboxCallback, moonraker: Moonraker):
-    await moonraker.gcode_script(callback_data.gcode)
-    await callback.answer(text=f'done')
+async def callback_toolbox(callback: CallbackQuery, callback_data: ToolboxCallback, farm: Farm, outbox: Outbox):
+    # commands run in background in order of taps, the answer doesn't wait for the printer
+    machine = farm.get(callback_data.printer)
+    chat_id = callback.message.chat.id
+
+    def report_error(what: str, ex: Exception) -> None:
+        # taps merged into one move fail together, their reports are coalesced
+        text = farm.caption(machine, f'\N{Heavy Ballot X} <code>{escape(what)}</code> failed: {escape(str(ex))}')
+        outbox.send(
+            chat_id, lambda: callback.bot.send_message(chat_id, text),
+            priority=Outbox.PRIORITY_HIGH, key=f'gcode_error:{machine.name}:{what}'
+        )
+
+    queue = machine.gcode_queue
+    if callback_data.axis:
+        await queue.track_position()
+        position = queue.jog(callback_data.axis, callback_data.distance, on_error=report_error)
+        if position is not None:
+            await callback.answer(text=f'{callback_data.axis} \N{Rightwards Arrow} {position:.1f} queued')
+        else:
+            await callback.answer(text=f'{callback_data.axis} {callback_data.distance:+g} queued')
+    else:
+        queue.script(callback_data.gcode, on_error=report_error)
+        await callback.answer(text=f'{callback_data.gcode} queued')
 
 @router.message(Command('toolbox'))
-async def handler_command_toolbox(message: Message):
+async def handler_command_toolbox(message: Message, command: CommandObject, farm: Farm):
     try:
-        await message.answer(f'\N{Wrench} toolbox', reply_markup=make_toolbox_keyboard(25))
+        machine, _ = farm.select(command.args)
+        await machine.gcode_queue.track_position()
+        await message.answer(
+            farm.caption(machine, f'\N{Wrench} toolbox'), reply_markup=make_toolbox_keyboard(machine.name, 25)
+        )
     except Exception as ex:
         await message.reply(f'\N{Heavy Ballot X} error: {ex}')
         logger.exception(f'exception during process message {message}')
@@ -2,18 +2,19 @@ import logging
 
 from aiogram import Router
 from aiogram.types import Message, BufferedInputFile
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
-from app.webcam import get_webcam_video
+from app.farm import Farm
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 @router.message(Command('video'))
-async def handler_command_video(message: Message):
+async def handler_command_video(message: Message, command: CommandObject, farm: Farm):
     notification_message = await message.answer('\N{SLEEPING SYMBOL}...')
     try:
-        video = await get_webcam_video()
+        machine, _ = farm.select(command.args)
+        video = await machine.webcam.get_video()
         if video is None:
             raise RuntimeError('failed to capture video (see logs)')
         await message.reply_video(BufferedInputFile(video, 'live.mp4'))
@@ -0,0 +1,115 @@
+import logging
+import asyncio
+import html
+import io
+import re
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.config_reader import WebcamConfig
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# no html and no emoji the default font can't draw
+def overlay_lines(text: str) -> List[str]:
+    text = html.unescape(re.sub(r'<[^>]+>', '', text)).replace('\N{Degree Celsius}', '\N{Degree Sign}C')
+    lines = []
+    for line in text.splitlines():
+        line = ''.join(char for char in line if ord(char) < 0x2000).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def draw_overlay(image: Image.Image, lines: List[str]) -> None:
+    font_size = max(image.height // 32, 10)
+    try:
+        font = ImageFont.load_default(font_size)
+    except TypeError:
+        # sized default font needs Pillow >= 10.1 with FreeType
+        font = ImageFont.load_default()
+
+    padding = font_size // 2
+    line_height = font_size + font_size // 4
+    width = max(int(font.getlength(line)) for line in lines) + 2 * padding
+    height = line_height * len(lines) + 2 * padding
+    top = image.height - height
+
+    box = Image.new('RGBA', (width, height), (0, 0, 0, 140))
+    image.paste(box, (0, top), box)
+    draw = ImageDraw.Draw(image)
+    for number, line in enumerate(lines):
+        draw.text((padding, top + padding + number * line_height), line, font=font, fill=(255, 255, 255))
+
+
+def paste_thumbnail(image: Image.Image, data: bytes) -> None:
+    thumbnail = Image.open(io.BytesIO(data)).convert('RGBA')
+    size = max(image.height // 4, 32)
+    thumbnail.thumbnail((size, size))
+    margin = max(image.height // 64, 2)
+    position = (image.width - thumbnail.width - margin, margin)
+
+    background = Image.new('RGBA', thumbnail.size, (0, 0, 0, 140))
+    image.paste(background, position, background)
+    image.paste(thumbnail, position, thumbnail)
+
+
+def render_snapshot(frame: bytes, max_size: int, quality: int, lines: Optional[List[str]],
+                    thumbnail: Optional[bytes]) -> bytes:
+    image = Image.open(io.BytesIO(frame))
+    if max_size > 0:
+        # JPEG frames are decoded at a reduced scale right away, much cheaper than a full decode and resize
+        image.draft('RGB', (max_size, max_size))
+    image = image.convert('RGB')
+    if max_size > 0:
+        image.thumbnail((max_size, max_size))
+
+    if thumbnail:
+        try:
+            paste_thumbnail(image, thumbnail)
+        except Exception as e:
+            logger.warning(f'failed to paste thumbnail ({e})')
+    if lines:
+        draw_overlay(image, lines)
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+
+# a frame within image_max_size with nothing to draw is passed through, the original one on errors
+class ImagePipeline:
+    def __init__(self, config: WebcamConfig) -> None:
+        self._max_size = config.image_max_size
+        self._quality = config.image_quality
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-pipeline')
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def process(self, frame: bytes, status: Optional[str] = None, thumbnail: Optional[bytes] = None) -> bytes:
+        lines = overlay_lines(status) if status else None
+        start = metrics.now()
+        try:
+            if not lines and not thumbnail and not self._oversized(frame):
+                return frame
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, render_snapshot, frame, self._max_size, self._quality, lines, thumbnail
+            )
+        except Exception as e:
+            logger.error(f'failed to process image ({e})')
+            return frame
+        finally:
+            metrics.histogram('image_process_seconds').observe_since(start)
+
+    def _oversized(self, frame: bytes) -> bool:
+        if self._max_size <= 0:
+            return False
+        # header only, no pixels are decoded
+        width, height = Image.open(io.BytesIO(frame)).size
+        return max(width, height) > self._max_size
@@ -0,0 +1,65 @@
+import logging
+
+from typing import Optional, Dict
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto, Message
+from aiogram.exceptions import TelegramBadRequest
+
+from app.shared_file import SharedFile
+
+logger = logging.getLogger(__name__)
+
+
+class LiveMessage:
+    __slots__ = ('tag', 'message_id', 'photo')
+
+    def __init__(self, tag: Optional[str], message_id: int, photo: bool) -> None:
+        self.tag = tag
+        self.message_id = message_id
+        self.photo = photo
+
+
+# one live message per key (printer), an update for another tag (file) posts a new one
+class LiveStatus:
+    def __init__(self, bot: Bot, chat_id: int) -> None:
+        self._bot = bot
+        self._chat_id = chat_id
+        self._messages: Dict[str, LiveMessage] = {}
+
+    def has(self, key: str, tag: Optional[str]) -> bool:
+        return key in self._messages and self._messages[key].tag == tag
+
+    def forget(self, key: str) -> None:
+        self._messages.pop(key, None)
+
+    async def post(self, key: str, text: str, image: Optional[SharedFile], tag: Optional[str] = None) -> Message:
+        if image is not None:
+            message = await image.send(
+                lambda photo: self._bot.send_photo(chat_id=self._chat_id, photo=photo, caption=text)
+            )
+        else:
+            message = await self._bot.send_message(chat_id=self._chat_id, text=text)
+        self._messages[key] = LiveMessage(tag, message.message_id, image is not None)
+        return message
+
+    async def update(self, key: str, text: str, image: Optional[SharedFile], tag: Optional[str] = None) -> None:
+        live = self._messages.get(key)
+        if live is None or live.tag != tag or (image is not None and not live.photo):
+            await self.post(key, text, image, tag)
+            return
+
+        try:
+            if image is not None:
+                await image.send(lambda photo: self._bot.edit_message_media(
+                    chat_id=self._chat_id, message_id=live.message_id, media=InputMediaPhoto(media=photo, caption=text)
+                ))
+            elif live.photo:
+                await self._bot.edit_message_caption(chat_id=self._chat_id, message_id=live.message_id, caption=text)
+            else:
+                await self._bot.edit_message_text(chat_id=self._chat_id, message_id=live.message_id, text=text)
+        except TelegramBadRequest as e:
+            if 'message is not modified' in e.message:
+                return
+            logger.warning(f'failed to edit live status message {live.message_id} ({e.message}), posting new one')
+            await self.post(key, text, image, tag)
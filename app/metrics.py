@@ -0,0 +1,189 @@
+import logging
+import time
+
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Tuple, List, Deque, Optional
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value', '_seconds')
+
+    # seconds kept for the rate estimation
+    RATE_WINDOW = 60
+
+    def __init__(self, name: str, labels: Labels) -> None:
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._seconds: Deque[List[int]] = deque(maxlen=Counter.RATE_WINDOW + 1)
+
+    def inc(self, amount: int = 1) -> None:
+        if not metrics.enabled:
+            return
+        self.value += amount
+        second = int(time.monotonic())
+        if self._seconds and self._seconds[-1][0] == second:
+            self._seconds[-1][1] += amount
+        else:
+            self._seconds.append([second, amount])
+
+    # per second over the last RATE_WINDOW seconds
+    def rate(self) -> float:
+        since = int(time.monotonic()) - Counter.RATE_WINDOW
+        return sum(amount for second, amount in self._seconds if second >= since) / Counter.RATE_WINDOW
+
+
+class Histogram:
+    __slots__ = ('name', 'labels', 'counts', 'sum', 'count')
+
+    # seconds, the last bucket is +Inf
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, labels: Labels) -> None:
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        if not metrics.enabled:
+            return
+        self.counts[bisect_left(Histogram.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, start: float) -> None:
+        if metrics.enabled:
+            self.observe(time.perf_counter() - start)
+
+    # upper bound of the bucket containing the quantile
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count:
+                return Histogram.BUCKETS[index] if index < len(Histogram.BUCKETS) else float('inf')
+        return 0.0
+
+
+# disabled metrics drop observations after a single flag check and now() doesn't read the clock
+class Metrics:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._counters: Dict[Tuple[str, Labels], Counter] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def now(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = Counter(*key)
+        return counter
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(*key)
+        return histogram
+
+    def summary(self) -> str:
+        lines = []
+        for counter in sorted(self._counters.values(), key=lambda c: (c.name, c.labels)):
+            lines.append(f'{counter.name}{format_labels(counter.labels)}: {counter.value} ({counter.rate():.1f}/s)')
+        for histogram in sorted(self._histograms.values(), key=lambda h: (h.name, h.labels)):
+            if not histogram.count:
+                continue
+            lines.append(
+                f'{histogram.name}{format_labels(histogram.labels)}: {histogram.count}, '
+                f'avg {histogram.sum / histogram.count * 1000:.1f}ms, p95 <{histogram.quantile(0.95) * 1000:g}ms'
+            )
+        return '\n'.join(lines)
+
+    def prometheus(self) -> str:
+        lines = []
+        for name in sorted({counter.name for counter in self._counters.values()}):
+            lines.append(f'# TYPE {name} counter')
+            for counter in self._counters.values():
+                if counter.name == name:
+                    lines.append(f'{name}{format_labels(counter.labels)} {counter.value}')
+        for name in sorted({histogram.name for histogram in self._histograms.values()}):
+            lines.append(f'# TYPE {name} histogram')
+            for histogram in self._histograms.values():
+                if histogram.name != name:
+                    continue
+                total = 0
+                for bound, count in zip(Histogram.BUCKETS + ('+Inf',), histogram.counts):
+                    total += count
+                    lines.append(f'{name}_bucket{format_labels(histogram.labels + (("le", str(bound)),))} {total}')
+                lines.append(f'{name}_sum{format_labels(histogram.labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(histogram.labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int) -> None:
+        self._host = host
+        self._port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def open(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        logger.info(f'serving metrics on http://{self._host}:{self._port}/metrics')
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=metrics.prometheus().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        name = type(method).__name__
+        start = metrics.now()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            metrics.counter('telegram_retry_after_total', method=name).inc()
+            raise
+        except Exception:
+            metrics.counter('telegram_errors_total', method=name).inc()
+            raise
+        finally:
+            metrics.histogram('telegram_request_seconds', method=name).observe_since(start)
+
+
+metrics = Metrics()
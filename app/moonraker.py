@@ -1,37 +1,77 @@
 import asyncio
-import aiohttp
-import ujson
 import logging
 
-from typing import Optional
+from typing import Optional, List, Tuple, Dict, Iterable, Callable
 
 from app.moonraker_session import MoonrakerSession
 from app.printer import Printer
+from app.thumbnail_cache import ThumbnailCache
+from app.file_index import FileIndex
+from app.subscription import SubscriptionPlanner
+from app.session_recorder import SessionRecorder
 
 logger = logging.getLogger(__name__)
 
 class Moonraker:
-    def __init__(self, endpoint: str) -> None:
-        self._url = f'http://{endpoint}'
-        self._session = MoonrakerSession(endpoint)
+    GCODE_TIMEOUT = 600.0
+    # fields read by printer state tracking, notifications and status messages
+    CORE_FIELDS = {
+        'print_stats': ['state', 'filename', 'print_duration', 'filament_used', 'info'],
+        'display_status': ['progress', 'message'],
+        'virtual_sdcard': ['progress'],
+        'extruder': ['temperature', 'target'],
+        'heater_bed': ['temperature', 'target'],
+        'webhooks': ['state']
+    }
+
+    def __init__(self, endpoint: str, event_queue_size: int = 100, event_overflow: str = 'coalesce',
+                 request_timeout: float = MoonrakerSession.REQUEST_TIMEOUT,
+                 gcode_timeout: float = GCODE_TIMEOUT, thumbnail_cache: Optional[ThumbnailCache] = None,
+                 recorder: Optional[SessionRecorder] = None, http_endpoint: Optional[str] = None) -> None:
+        self._gcode_timeout = gcode_timeout
+        self._session = MoonrakerSession(
+            endpoint, request_timeout=request_timeout, recorder=recorder, http_endpoint=http_endpoint
+        )
+        self._thumbnails = thumbnail_cache or ThumbnailCache(max_size=0)
+        self.files = FileIndex(self._session)
+        self._subscriptions = SubscriptionPlanner()
+        self._subscriptions.require('core', Moonraker.CORE_FIELDS)
+        self._gcode_listeners: List[Callable[[str], None]] = []
         self._session.add_listener(self._update)
-        self.printer = Printer()
+        self.printer = Printer(event_queue_size=event_queue_size, event_overflow=event_overflow)
 
     def online(self) -> bool:
         return self._session.online()
 
+    def add_gcode_listener(self, callback: Callable[[str], None]) -> None:
+        self._gcode_listeners.append(callback)
+
     async def open(self):
         await self._session.open()
 
     async def close(self):
+        await self.files.close()
         await self._session.close()
+        await self.printer.close()
+
+    def stats(self) -> dict:
+        return self._session.stats()
+
+    # fields None subscribes to the whole object
+    async def require_fields(self, feature: str, objects: Dict[str, Optional[Iterable[str]]]) -> None:
+        if self._subscriptions.require(feature, objects):
+            await self._resubscribe()
+
+    async def release_fields(self, feature: str) -> None:
+        if self._subscriptions.release(feature):
+            await self._resubscribe()
+
+    async def request_batch(self, calls: List[Tuple[str, Optional[dict]]], raise_errors: bool = True) -> list:
+        return await self._session.request_batch(calls, raise_errors=raise_errors)
 
     async def emergency_stop(self) -> dict:
         return await self._session.request('printer.emergency_stop')
 
-    async def gcode_script(self, script: str) -> dict:
-        return await self._session.request('printer.gcode.script', {'script': script})
-
     async def get_file_dir(self, path: str) -> dict:
         return await self._session.request('server.files.list', {'path': path})
 
@@ -66,61 +106,75 @@ class Moonraker:
         return await self._session.request('server.history.list', { 'limit': limit, 'start': start, 'order': order })
 
     async def gcode_script(self, script: str) -> dict:
-        return await self._session.request('printer.gcode.script', { 'script': script })
-
-    async def get_thumbnail(self, path: str) -> Optional[bytes]:
-        return await self._http_get(f'/server/files/gcodes/{path}')
+        # scripts like homing or bed mesh calibration take a while
+        return await self._session.request('printer.gcode.script', {'script': script}, timeout=self._gcode_timeout)
+
+    # `modified` is the modification time of the gcode file
+    async def get_thumbnail(self, path: str, modified: Optional[float] = None) -> Optional[bytes]:
+        image = await self._thumbnails.get(path, modified)
+        if image is None:
+            image = await self._http_get(f'/server/files/gcodes/{path}')
+            if image is not None:
+                await self._thumbnails.put(path, modified, image)
+        return image
+
+    # a recorded notification, see app.session_replay
+    async def replay(self, method: str, params: Optional[dict]) -> None:
+        if method in ['connected', 'notify_klippy_ready']:
+            # the recorded subscription response follows
+            self.printer.reset()
+        else:
+            await self._update(method, params)
 
     async def _update(self, method: str, params: Optional[dict]) -> None:
         if method == 'notify_status_update':
             self.printer.update(params)
+        elif method == 'notify_filelist_changed':
+            for item in (params.get('item'), params.get('source_item')):
+                if item and item.get('root') == 'gcodes':
+                    self._thumbnails.invalidate(item['path'])
+            self.files.update(params)
         elif method == 'notify_gcode_response':
-            logger.debug(ujson.dumps(params, 2)) # TODO
+            for callback in self._gcode_listeners:
+                callback(params)
         elif method in ['connected', 'notify_klippy_ready']:
             self.printer.reset()
             logger.info(f'subscribing printer objects (method: "{method}")')
-            await self._subscribe_printer_objects()
+            if method == 'connected':
+                # independent requests, don't wait for one before sending another
+                await asyncio.gather(self._subscribe_printer_objects(), self._load_file_index())
+            else:
+                await self._subscribe_printer_objects()
         elif method == 'notify_klippy_disconnected':
             self.printer.change_state('disconnected')
         elif method == 'notify_klippy_shutdown':
             self.printer.change_state('shutdown')
 
+    async def _load_file_index(self) -> None:
+        try:
+            await self.files.load()
+        except Exception as e:
+            logger.error(f'failed to load file index ({e})')
+
+    async def _resubscribe(self) -> None:
+        if not self.online():
+            # the new plan is used on connect
+            return
+        try:
+            await self._subscribe_printer_objects()
+        except Exception as e:
+            logger.error(f'failed to update subscription ({e})')
+
     async def _subscribe_printer_objects(self) -> None:
-        data = await self._session.request('printer.objects.subscribe', {
-            'objects': {
-                'bed_mesh': None,
-                # 'configfile': None,
-                'display_status': None,
-                'extruder': None,
-                'fan': None,
-                'gcode_move': None,
-                'heater_bed': None,
-                'idle_timeout': None,
-                'pause_resume': None,
-                'print_stats': None,
-                'toolhead': None,
-                'virtual_sdcard': None,
-                'webhooks': None,
-                'motion_report': None,
-                'firmware_retraction': None,
-                'exclude_object': None
-            }
-        })
+        # a new subscription replaces the previous one of the connection
+        objects = self._subscriptions.plan()
+        logger.debug(f'subscription: {objects}')
+        data = await self._session.request('printer.objects.subscribe', {'objects': objects})
         self.printer.update(data['status'])
 
     async def _http_get(self, path: str) -> Optional[bytes]:
-        if path.startswith('/'):
-            url = f'{self._url}{path}'
-        else:
-            url = f'{self._url}/{path}'
-
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        raise Exception(f'invalid response code {response.status}')
+            return await self._session.http_get(path)
         except Exception as e:
-            logger.error(f'failed to get "{url}" ({e})')
+            logger.error(f'failed to get "{path}" ({e})')
         return None
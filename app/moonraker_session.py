@@ -2,87 +2,215 @@ import asyncio
 import aiohttp
 import ujson
 import logging
+import random
 
-from typing import Optional, Callable
-from inspect import iscoroutinefunction
+from typing import Optional, Callable, List, Tuple, Any
+
+from app.event_bus import EventBus
+from app.metrics import metrics
+from app.moonraker_transport import Transport, WebsocketTransport, UnixSocketTransport
+from app.session_recorder import SessionRecorder
 
 logger = logging.getLogger(__name__)
 
+class RequestStats:
+    __slots__ = ('count', 'errors', 'timeouts', 'total_time', 'max_time')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def observe(self, elapsed: float) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time
+        }
+
 class MoonrakerSession:
     DEFAULT_PORT = 7125
-    RECONNECT_INTERVAL = 10.0
-    HEARTBEAT_INTERVAL = 5.0
-
-    def __init__(self, endpoint: str) -> None:
-        if ':' in endpoint:
-            host, port = endpoint.split(':')
-        else:
-            host, port = (endpoint, str(MoonrakerSession.DEFAULT_PORT))
-
-        self._endpoint = f'{host}:{port}'
+    # first reconnect delay, doubled on every failed attempt up to the max one
+    RECONNECT_INTERVAL = 0.5
+    RECONNECT_MAX_INTERVAL = 30.0
+    # the backoff starts over only after a connection stayed up that many seconds
+    STABLE_CONNECTION_TIME = 10.0
+    # status updates are deltas, so the queue is large enough to never drop one in practice
+    EVENT_QUEUE_SIZE = 10000
+    REQUEST_TIMEOUT = 30.0
+
+    # endpoint is host[:port] or unix:<path>, http requests always go through tcp to http_endpoint,
+    # the websocket host or the default local port
+    def __init__(self, endpoint: str, request_timeout: float = REQUEST_TIMEOUT,
+                 recorder: Optional[SessionRecorder] = None, http_endpoint: Optional[str] = None) -> None:
         self._task = None
         self._session: Optional[aiohttp.ClientSession] = None
-        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
-        self._listeners = []
+        self._transport: Transport
+        if endpoint.startswith('unix:'):
+            self._endpoint = endpoint
+            self._http_endpoint = self._normalize_endpoint(http_endpoint or '127.0.0.1')
+            self._transport = UnixSocketTransport(endpoint[len('unix:'):])
+        else:
+            self._endpoint = self._normalize_endpoint(endpoint)
+            self._http_endpoint = self._normalize_endpoint(http_endpoint) if http_endpoint else self._endpoint
+            self._transport = WebsocketTransport(self._endpoint, self._http_session, request_timeout)
+        self._events = EventBus('moonraker', max_depth=MoonrakerSession.EVENT_QUEUE_SIZE)
         self._requests = dict()
         self._next_id = 0
-        self._background_tasks = set()
+        self._request_timeout = request_timeout
+        self._stats = RequestStats()
+        self._recorder = recorder
+        self._last_reconnect_time: Optional[float] = None
+        self._reconnect_time = metrics.histogram('moonraker_reconnect_seconds', endpoint=self._endpoint)
+        self._frames = metrics.counter('moonraker_frames_total', endpoint=self._endpoint)
+        self._decode_time = metrics.histogram('moonraker_frame_decode_seconds', endpoint=self._endpoint)
 
     def add_listener(self, callback: Callable) -> None:
-        self._listeners.append(callback)
+        self._events.add_listener('notification', callback)
 
     def online(self) -> bool:
-        return self._ws and not self._ws.closed
+        return self._transport.connected()
 
     async def open(self) -> None:
         if self._task and not self._task.done():
             raise Exception('moonraker service already running')
+        if self._recorder:
+            await self._recorder.open()
         self._task = asyncio.create_task(self._loop_task())
 
     async def close(self) -> None:
-        if not self._task or self._task.done():
-            return
-
-        self._task.cancel()
-        await self._task
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await self._task
+
+        if self._session and not self._session.closed:
+            await self._session.close()
+        await self._events.close()
+        if self._recorder:
+            await self._recorder.close()
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._requests),
+            **self._stats.as_dict(),
+            'last_reconnect_time': self._last_reconnect_time or 0.0
+        }
+
+    async def request(self, method: str, params: Optional[dict] = None, timeout: Optional[float] = None) -> dict:
+        results = await self._call([(method, params)], timeout, batch=False, raise_errors=True)
+        return results[0]
+
+    # failed calls are returned as RuntimeError instances without raise_errors
+    async def request_batch(self, calls: List[Tuple[str, Optional[dict]]], timeout: Optional[float] = None,
+                            raise_errors: bool = True) -> list:
+        if not calls:
+            return []
+        return await self._call(calls, timeout, batch=True, raise_errors=raise_errors)
+
+    async def _call(self, calls: List[Tuple[str, Optional[dict]]], timeout: Optional[float], batch: bool,
+                    raise_errors: bool) -> list:
+        if not self._transport.connected():
+            raise RuntimeError('moonraker not connected')
 
-    async def request(self, method: str, params: Optional[dict] = None) -> dict:
-        future = asyncio.Future()
-        id = self._get_next_id()
-        self._requests[id] = future
+        loop = asyncio.get_running_loop()
+        ids = [self._get_next_id() for _ in calls]
+        futures = []
+        for id in ids:
+            future = loop.create_future()
+            self._requests[id] = future
+            futures.append(future)
 
+        start_time = loop.time()
         try:
-            await self._send_request(method, params=params, id=id)
+            requests = [self._make_request(method, params, id) for (method, params), id in zip(calls, ids)]
+            await self._send(requests if batch else requests[0])
+            # asyncio.wait doesn't leave an unretrieved gather exception behind when the caller is cancelled
+            _, pending = await asyncio.wait(futures, timeout=timeout if timeout is not None else self._request_timeout)
+            if pending:
+                raise asyncio.TimeoutError()
+            errors = [future.exception() for future in futures]
+            error = next((error for error in errors if error is not None), None)
+            if error is not None:
+                raise error
+            responses = [future.result() for future in futures]
+        except asyncio.TimeoutError:
+            self._stats.timeouts += 1
+            methods = ', '.join(method for method, _ in calls)
+            raise TimeoutError(f'moonraker request timed out ({methods})')
         except Exception:
-            del self._requests[id]
+            self._stats.errors += 1
             raise
+        finally:
+            for id, future in zip(ids, futures):
+                self._requests.pop(id, None)
+                # nobody waits for the future anymore, a disconnect must not leave an unretrieved exception in it
+                if not future.done():
+                    future.cancel()
+                elif not future.cancelled():
+                    future.exception()
+
+        self._stats.observe(loop.time() - start_time)
+        if metrics.enabled:
+            method = calls[0][0] if not batch else 'batch'
+            metrics.histogram('moonraker_request_seconds', method=method).observe(loop.time() - start_time)
+
+        results = []
+        for data in responses:
+            if 'error' in data:
+                self._stats.errors += 1
+                error = RuntimeError(data['error']['message'])
+                if raise_errors:
+                    raise error
+                results.append(error)
+            else:
+                results.append(data['result'])
+        return results
+
+    async def http_get(self, path: str) -> bytes:
+        url = f'http://{self._http_endpoint}/{path.lstrip("/")}'
+        timeout = aiohttp.ClientTimeout(total=self._request_timeout)
+        async with self._http_session().get(url, timeout=timeout) as response:
+            if response.status != 200:
+                raise RuntimeError(f'invalid response code {response.status}')
+            return await response.read()
+
+    def _http_session(self) -> aiohttp.ClientSession:
+        if not self._session or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    @staticmethod
+    def _normalize_endpoint(endpoint: str) -> str:
+        if ':' in endpoint:
+            host, port = endpoint.split(':')
+        else:
+            host, port = (endpoint, str(MoonrakerSession.DEFAULT_PORT))
+        return f'{host}:{port}'
 
-        await future
-        if future.exception():
-            raise future.exception()
-
-        data = future.result()
-        if 'error' in data:
-            raise RuntimeError(data['error']['message'])
-
-        return data['result']
-
-    async def _send_request(self, method: str, params: Optional[dict] = None, id: Optional[int] = None) -> None:
-        if self._ws is None or self._ws.closed:
-            raise RuntimeError('moonraker not connected')
-
-        if id is None:
-            id = self._get_next_id()
-
-        request_str = ujson.dumps({
+    def _make_request(self, method: str, params: Optional[dict], id: int) -> dict:
+        return {
             'jsonrpc': '2.0',
             'method': method,
             'params': params or {},
             'id': id
-        })
+        }
+
+    async def _send(self, payload: Any) -> None:
+        request_str = ujson.dumps(payload)
         logger.debug(f'send_request: {request_str}')
+        if self._recorder:
+            self._recorder.record(SessionRecorder.OUTBOUND, request_str)
 
-        await self._ws.send_str(request_str)
+        await self._transport.send(request_str)
 
     def _get_next_id(self) -> int:
         id = self._next_id
@@ -90,68 +218,95 @@ class MoonrakerSession:
         return id
 
     async def _loop_task(self) -> None:
-        async def get_oneshot_token() -> str:
-            url = f'http://{self._endpoint}/access/oneshot_token'
-            async with self._session.get(url) as response:
-                if response.status != 200:
-                    raise Exception('unable to get oneshot token')
-                data = await response.json()
-                return data['result']
-
         try:
-            next_connect_time = 0.0
+            attempt = 0
+            fast_retry = False
+            disconnect_time = None
 
             while True:
                 loop = asyncio.get_running_loop()
-                if next_connect_time > loop.time():
-                    await asyncio.sleep(next_connect_time - loop.time())
-                next_connect_time = loop.time() + MoonrakerSession.RECONNECT_INTERVAL
-
-                self._clear_requests()
+                if attempt > 0 and not fast_retry:
+                    await asyncio.sleep(self._reconnect_delay(attempt))
+                retried_fast = fast_retry
+                fast_retry = False
 
                 try:
-                    if not self._session or self._session.closed:
-                        self._session = aiohttp.ClientSession()
-
-                    oneshot_token = await get_oneshot_token()
-                    logger.debug(f'oneshot token: {oneshot_token}')
-
-                    if not self._ws or self._ws.closed:
-                        url = f'ws://{self._endpoint}/websocket?token={oneshot_token}'
-                        self._ws = await self._session.ws_connect(url, heartbeat=MoonrakerSession.HEARTBEAT_INTERVAL)
-                        logger.info(f'connected to {url}')
-
+                    await self._transport.connect()
                 except Exception as e:
-                    logger.error(f'failed to establish connection ({e})')
+                    attempt += 1
+                    logger.error(f'failed to establish connection ({e}), attempt {attempt}')
                     continue
 
+                connect_time = loop.time()
+                if disconnect_time is not None:
+                    self._last_reconnect_time = loop.time() - disconnect_time
+                    self._reconnect_time.observe(self._last_reconnect_time)
+                    logger.info(f'reconnected in {self._last_reconnect_time:.2f}s')
+
+                if self._recorder:
+                    self._recorder.record(SessionRecorder.EVENT, 'connected')
                 self._invoke_callback('connected', {})
 
-                async for message in self._ws:
-                    logger.debug("received message")
-                    if message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.ERROR):
+                while True:
+                    frame = await self._transport.receive()
+                    if frame is None:
                         break
-                    if message.type != aiohttp.WSMsgType.TEXT:
-                        continue
-
-                    self._process_message(message.json())
 
-                logger.warning('closing websocket connection')
-                if self._ws and not self._ws.closed:
-                    await self._ws.close()
+                    # a malformed frame is skipped, it must not stop the connection loop
+                    try:
+                        # decode the raw frame with ujson instead of the stdlib json behind message.json()
+                        start = metrics.now()
+                        data = ujson.loads(frame)
+                        self._decode_time.observe_since(start)
+                        self._frames.inc()
+                        if self._recorder:
+                            self._recorder.record(
+                                SessionRecorder.INBOUND, frame if isinstance(frame, str) else frame.decode()
+                            )
+
+                        self._process_message(data)
+                    except Exception:
+                        logger.exception(f'failed to process moonraker frame {frame[:256]!r}')
+
+                disconnect_time = loop.time()
+                if disconnect_time - connect_time >= MoonrakerSession.STABLE_CONNECTION_TIME:
+                    attempt = 0
+                else:
+                    # a server accepting connections and dropping them right away backs off like a failed connect
+                    attempt += 1
+                clean = self._transport.clean_close()
+                # moonraker closes the socket properly when it restarts, try again right away but once in a row
+                fast_retry = clean and not retried_fast
+                logger.warning(f'moonraker connection closed ({"clean" if clean else "error"})')
+                if self._recorder:
+                    self._recorder.record(SessionRecorder.EVENT, 'disconnected')
+                await self._transport.close()
+                # fail requests in flight right away rather than after the reconnect delay
+                self._clear_requests()
 
         except asyncio.CancelledError as e:
             pass
 
         finally:
-            if self._ws and not self._ws.closed:
-                await self._ws.close()
+            await self._transport.close()
             if self._session and not self._session.closed:
                 await self._session.close()
             self._clear_requests()
 
+    def _reconnect_delay(self, attempt: int) -> float:
+        # exponential backoff with jitter, so printers behind the same host don't retry in lockstep
+        delay = min(MoonrakerSession.RECONNECT_MAX_INTERVAL, MoonrakerSession.RECONNECT_INTERVAL * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
     def _process_message(self, data) -> None:
-        logger.debug(f'data: {ujson.dumps(data, indent=2)}')
+        if isinstance(data, list):
+            # batch response
+            for item in data:
+                self._process_message(item)
+            return
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'data: {ujson.dumps(data, indent=2)}')
 
         if 'method' in data:
             method = data['method']
@@ -162,27 +317,17 @@ class MoonrakerSession:
         if 'id' in data:
             id = data['id']
             if id in self._requests:
-                future = self._requests[id]
-                future.set_result(data)
-                del self._requests[id]
+                future = self._requests.pop(id)
+                if not future.done():
+                    future.set_result(data)
             return
 
     def _invoke_callback(self, method: str, params: dict) -> None:
-        for callback in self._listeners:
-            try:
-                if iscoroutinefunction(callback):
-                    task = asyncio.create_task(callback(method, params))
-                else:
-                    callback(method, params)
-            except Exception as e:
-                logger.error(f'got exception during invoke callback "{method}": {e}')
-            else:
-                if task:
-                    self._background_tasks.add(task)
-                    task.add_done_callback(self._background_tasks.discard)
+        self._events.emit('notification', method, params)
 
     def _clear_requests(self):
         for _, request in self._requests.items():
             logger.debug(f'clearing pending request {request}')
-            request.cancel()
+            if not request.done():
+                request.set_exception(RuntimeError('moonraker disconnected'))
         self._requests.clear()
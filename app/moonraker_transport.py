@@ -0,0 +1,148 @@
+import logging
+import asyncio
+import aiohttp
+
+from typing import Optional, Callable, Union
+
+logger = logging.getLogger(__name__)
+
+
+class Transport:
+    def connected(self) -> bool:
+        raise NotImplementedError()
+
+    # closed by moonraker on purpose (e.g. restart)
+    def clean_close(self) -> bool:
+        raise NotImplementedError()
+
+    async def connect(self) -> None:
+        raise NotImplementedError()
+
+    async def send(self, frame: str) -> None:
+        raise NotImplementedError()
+
+    # None when the connection is closed
+    async def receive(self) -> Optional[Union[str, bytes]]:
+        raise NotImplementedError()
+
+    async def close(self) -> None:
+        raise NotImplementedError()
+
+
+class WebsocketTransport(Transport):
+    HEARTBEAT_INTERVAL = 5.0
+    # oneshot tokens expire in 5 seconds
+    TOKEN_LIFETIME = 4.0
+
+    def __init__(self, endpoint: str, http_session: Callable[[], aiohttp.ClientSession], request_timeout: float):
+        self._endpoint = endpoint
+        self._http_session = http_session
+        self._request_timeout = request_timeout
+        self._ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self._token: Optional[str] = None
+        self._token_time = 0.0
+
+    def connected(self) -> bool:
+        return self._ws is not None and not self._ws.closed
+
+    def clean_close(self) -> bool:
+        return self._ws is not None and self._ws.close_code in (aiohttp.WSCloseCode.OK, aiohttp.WSCloseCode.GOING_AWAY)
+
+    async def connect(self) -> None:
+        token = await self._get_oneshot_token()
+
+        url = f'ws://{self._endpoint}/websocket'
+        if token is not None:
+            url += f'?token={token}'
+        self._ws = await self._http_session().ws_connect(url, heartbeat=WebsocketTransport.HEARTBEAT_INTERVAL)
+        # the token is used up by the successful connect
+        self._token = None
+        logger.info(f'connected to ws://{self._endpoint}/websocket')
+
+    async def send(self, frame: str) -> None:
+        await self._ws.send_str(frame)
+
+    async def receive(self) -> Optional[Union[str, bytes]]:
+        while True:
+            message = await self._ws.receive()
+            if message.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                return message.data
+            if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED,
+                                aiohttp.WSMsgType.ERROR):
+                return None
+
+    async def close(self) -> None:
+        if self._ws and not self._ws.closed:
+            await self._ws.close()
+
+    # None if moonraker has no authorization, a token not used by a failed connect is reused
+    async def _get_oneshot_token(self) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        if self._token is not None and loop.time() - self._token_time < WebsocketTransport.TOKEN_LIFETIME:
+            return self._token
+
+        url = f'http://{self._endpoint}/access/oneshot_token'
+        timeout = aiohttp.ClientTimeout(total=self._request_timeout)
+        async with self._http_session().get(url, timeout=timeout) as response:
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                raise Exception(f'unable to get oneshot token (status {response.status})')
+            data = await response.json()
+
+        logger.debug(f'oneshot token: {data["result"]}')
+        self._token = data['result']
+        self._token_time = loop.time()
+        return self._token
+
+
+# moonraker.sock: JSON-RPC frames terminated by ETX, no http and no token
+class UnixSocketTransport(Transport):
+    ETX = b'\x03'
+    # largest accepted frame, a file list of a big library takes a few megabytes
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._clean_close = False
+
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def clean_close(self) -> bool:
+        return self._clean_close
+
+    async def connect(self) -> None:
+        self._clean_close = False
+        self._reader, self._writer = await asyncio.open_unix_connection(
+            self._path, limit=UnixSocketTransport.MAX_FRAME_SIZE
+        )
+        logger.info(f'connected to unix:{self._path}')
+
+    async def send(self, frame: str) -> None:
+        self._writer.write(frame.encode() + UnixSocketTransport.ETX)
+        await self._writer.drain()
+
+    async def receive(self) -> Optional[Union[str, bytes]]:
+        try:
+            frame = await self._reader.readuntil(UnixSocketTransport.ETX)
+        except asyncio.IncompleteReadError:
+            # moonraker closed the socket
+            self._clean_close = True
+            await self.close()
+            return None
+        except (asyncio.LimitOverrunError, ConnectionError) as e:
+            logger.error(f'unix socket read failed ({e})')
+            await self.close()
+            return None
+        return frame[:-1]
+
+    async def close(self) -> None:
+        if self._writer and not self._writer.is_closing():
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
@@ -0,0 +1,119 @@
+import logging
+import asyncio
+
+from typing import Optional, Callable, Awaitable, Tuple, Dict, List
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from app.live_status import LiveStatus
+from app.outbox import Outbox
+from app.shared_file import SharedFile
+from app.subscribers import SubscriberRegistry
+
+logger = logging.getLogger(__name__)
+
+# text and optional photo of a notification
+Content = Tuple[str, Optional[InputFile]]
+
+
+# content is built once, before the chat turn, and shared by every recipient
+class Notification:
+    def __init__(self, build: Callable[[], Awaitable[Content]]) -> None:
+        self._build = build
+        self._task: Optional[asyncio.Task] = None
+
+    def ready(self) -> asyncio.Future:
+        # built before the chat turn, so taking a snapshot doesn't hold the chat in the outbox
+        if self._task is None:
+            self._task = asyncio.create_task(self._make())
+            # failure is reported by the sends, nothing is left unretrieved when they were all superseded
+            self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._task
+
+    async def content(self) -> Tuple[str, Optional[SharedFile]]:
+        return await self.ready()
+
+    async def _make(self) -> Tuple[str, Optional[SharedFile]]:
+        text, file = await self._build()
+        return text, SharedFile(file) if file is not None else None
+
+
+class Notifier:
+    def __init__(self, bot: Bot, outbox: Outbox, subscribers: SubscriberRegistry) -> None:
+        self._bot = bot
+        self._outbox = outbox
+        self._subscribers = subscribers
+        self._live_statuses: Dict[int, LiveStatus] = {}
+
+    # with forget_live the next live status of the printer is a new message in every chat
+    def notify(self, printer: str, events: Tuple[str, ...], build: Callable[[], Awaitable[Content]],
+               priority: int = Outbox.PRIORITY_NORMAL, key: Optional[str] = None,
+               forget_live: bool = False) -> List[asyncio.Future]:
+        notification = Notification(build)
+        recipients = self._subscribers.recipients(printer, *events)
+
+        async def send(chat_id: int):
+            if forget_live:
+                self._live_status(chat_id).forget(printer)
+            text, file = await notification.content()
+            if file is None:
+                return await self._bot.send_message(chat_id=chat_id, text=text)
+            return await file.send(lambda media: self._bot.send_photo(chat_id=chat_id, photo=media, caption=text))
+
+        async def forget(chat_id: int) -> None:
+            self._live_status(chat_id).forget(printer)
+
+        if forget_live:
+            for chat_id in self._live_statuses.keys() - set(recipients):
+                self._outbox.send(chat_id, lambda chat_id=chat_id: forget(chat_id), priority=priority, key=key)
+
+        return [
+            self._outbox.send(
+                chat_id, lambda chat_id=chat_id: send(chat_id), priority=priority, key=key, ready=notification.ready()
+            )
+            for chat_id in recipients
+        ]
+
+    def notify_live(self, printer: str, events: Tuple[str, ...], build: Callable[[], Awaitable[Content]],
+                    tag: Optional[str], update: bool, priority: int = Outbox.PRIORITY_NORMAL,
+                    key: Optional[str] = None) -> List[asyncio.Future]:
+        notification = Notification(build)
+
+        async def send(chat_id: int) -> None:
+            text, file = await notification.content()
+            live_status = self._live_status(chat_id)
+            if update:
+                await live_status.update(printer, text, file, tag)
+            else:
+                await live_status.post(printer, text, file, tag)
+
+        return [
+            self._outbox.send(
+                chat_id, lambda chat_id=chat_id: send(chat_id), priority=priority, key=key, ready=notification.ready()
+            )
+            for chat_id in self._subscribers.recipients(printer, *events)
+        ]
+
+    def send_video(self, printer: str, events: Tuple[str, ...], video: InputFile,
+                   caption: str, priority: int = Outbox.PRIORITY_LOW) -> List[asyncio.Future]:
+        file = SharedFile(video)
+        return [
+            self._outbox.send(chat_id, lambda chat_id=chat_id: file.send(
+                lambda media: self._bot.send_video(chat_id=chat_id, video=media, caption=caption)
+            ), priority=priority)
+            for chat_id in self._subscribers.recipients(printer, *events)
+        ]
+
+    def broadcast(self, text: str, priority: int = Outbox.PRIORITY_NORMAL, **kwargs) -> List[asyncio.Future]:
+        return [
+            self._outbox.send(
+                chat_id, lambda chat_id=chat_id: self._bot.send_message(chat_id, text, **kwargs), priority=priority
+            )
+            for chat_id in self._subscribers.chat_ids
+        ]
+
+    def _live_status(self, chat_id: int) -> LiveStatus:
+        if chat_id not in self._live_statuses:
+            self._live_statuses[chat_id] = LiveStatus(self._bot, chat_id)
+        return self._live_statuses[chat_id]
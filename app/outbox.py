@@ -0,0 +1,214 @@
+import logging
+import asyncio
+
+from contextvars import ContextVar
+from typing import Optional, Callable, Awaitable, Any, List, Dict, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+logger = logging.getLogger(__name__)
+
+# set while an outbox call runs, bot requests it makes are already rate limited
+_sending: ContextVar[bool] = ContextVar('outbox_sending', default=False)
+
+
+class OutboxItem:
+    __slots__ = ('chat_id', 'call', 'priority', 'key', 'seq', 'raise_errors', 'ready', 'future')
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int,
+                 key: Optional[Tuple[int, str]], seq: int, raise_errors: bool,
+                 ready: Optional[asyncio.Future]) -> None:
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.key = key
+        self.seq = seq
+        self.raise_errors = raise_errors
+        self.ready = ready
+        self.future = asyncio.get_running_loop().create_future()
+
+
+# messages go out in priority order, one at a time per chat and concurrently across chats,
+# a queued message is replaced by a newer one with the same key
+class Outbox:
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    CHAT_INTERVAL = 1.0
+    GLOBAL_INTERVAL = 1.0 / 30
+
+    def __init__(self) -> None:
+        self._task = None
+        self._items: List[OutboxItem] = []
+        self._keys: Dict[Tuple[int, str], OutboxItem] = {}
+        self._busy_chats: Set[int] = set()
+        self._chat_ready_time: Dict[int, float] = {}
+        # flood control pauses, they apply to direct requests too
+        self._chat_pause_time: Dict[int, float] = {}
+        self._global_ready_time = 0.0
+        self._next_seq = 0
+        self._wakeup = asyncio.Event()
+        self._background_tasks = set()
+
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def open(self) -> None:
+        if self._task and not self._task.done():
+            raise Exception('outbox already running')
+        self._task = asyncio.create_task(self._loop_task())
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await self._task
+
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
+        for item in self._items:
+            item.future.cancel()
+        self._items.clear()
+        self._keys.clear()
+
+    # the future gets the call result, or None when superseded or failed (the error with raise_errors);
+    # the message waits for `ready` without holding the chat
+    def send(self, chat_id: int, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_NORMAL,
+             key: Optional[str] = None, raise_errors: bool = False,
+             ready: Optional[asyncio.Future] = None) -> asyncio.Future:
+        if key is not None:
+            # keys are scoped by chat, the same notification queued for several chats doesn't collapse
+            key = (chat_id, key)
+        if key is not None and key in self._keys:
+            superseded = self._keys.pop(key)
+            self._items.remove(superseded)
+            superseded.future.set_result(None)
+            # don't lose urgency of the replaced message
+            priority = min(priority, superseded.priority)
+
+        item = OutboxItem(chat_id, call, priority, key, self._next_seq, raise_errors, ready)
+        if ready is not None and not ready.done():
+            ready.add_done_callback(lambda _: self._wakeup.set())
+        self._next_seq += 1
+        self._items.append(item)
+        if key is not None:
+            self._keys[key] = item
+
+        self._wakeup.set()
+        return item.future
+
+    # next item to send or time to wait for one
+    def _pick(self) -> Tuple[Optional[OutboxItem], Optional[float]]:
+        if not self._items:
+            return None, None
+
+        now = asyncio.get_running_loop().time()
+        if self._global_ready_time > now:
+            return None, self._global_ready_time - now
+
+        best = None
+        delay = None
+        for item in self._items:
+            if item.chat_id in self._busy_chats or (item.ready is not None and not item.ready.done()):
+                continue
+            ready_time = max(self._chat_ready_time.get(item.chat_id, 0.0), self._chat_pause_time.get(item.chat_id, 0.0))
+            if ready_time > now:
+                delay = ready_time - now if delay is None else min(delay, ready_time - now)
+                continue
+            if best is None or (item.priority, item.seq) < (best.priority, best.seq):
+                best = item
+
+        return best, delay
+
+    async def _loop_task(self) -> None:
+        try:
+            while True:
+                item, delay = self._pick()
+                if item is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._items.remove(item)
+                if item.key is not None:
+                    del self._keys[item.key]
+                self._busy_chats.add(item.chat_id)
+                self._global_ready_time = asyncio.get_running_loop().time() + Outbox.GLOBAL_INTERVAL
+
+                task = asyncio.create_task(self._send(item))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+
+        except asyncio.CancelledError:
+            pass
+
+    async def _send(self, item: OutboxItem) -> None:
+        loop = asyncio.get_running_loop()
+        # the task has its own context
+        _sending.set(True)
+        try:
+            result = await item.call()
+        except TelegramRetryAfter as e:
+            logger.warning(f'flood control for chat {item.chat_id}, retry in {e.retry_after}s')
+            self._chat_pause_time[item.chat_id] = loop.time() + e.retry_after
+            self._requeue(item)
+        except Exception as e:
+            if item.raise_errors:
+                item.future.set_exception(e)
+            else:
+                logger.error(f'failed to send message to chat {item.chat_id} ({e})')
+                item.future.set_result(None)
+        else:
+            item.future.set_result(result)
+        finally:
+            ready_time = loop.time() + Outbox.CHAT_INTERVAL
+            self._chat_ready_time[item.chat_id] = max(self._chat_ready_time.get(item.chat_id, 0.0), ready_time)
+            self._busy_chats.discard(item.chat_id)
+            self._wakeup.set()
+
+    async def request(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        while True:
+            pause = self._chat_pause_time.get(chat_id, 0.0) - loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                result = await call()
+            except TelegramRetryAfter as e:
+                logger.warning(f'flood control for chat {chat_id}, retry in {e.retry_after}s')
+                self._chat_pause_time[chat_id] = loop.time() + e.retry_after
+                continue
+            # queued notifications keep their distance from the request
+            ready_time = loop.time() + Outbox.CHAT_INTERVAL
+            self._chat_ready_time[chat_id] = max(self._chat_ready_time.get(chat_id, 0.0), ready_time)
+            return result
+
+    def _requeue(self, item: OutboxItem) -> None:
+        if item.key is not None:
+            if item.key in self._keys:
+                # newer message with the same key already queued
+                item.future.set_result(None)
+                return
+            self._keys[item.key] = item
+        self._items.append(item)
+
+
+# handler requests go out right away but wait out flood control of the chat
+class OutboxMiddleware(BaseRequestMiddleware):
+    def __init__(self, outbox: Outbox) -> None:
+        self._outbox = outbox
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or _sending.get() or not self._outbox.running():
+            return await make_request(bot, method)
+        return await self._outbox.request(chat_id, lambda: make_request(bot, method))
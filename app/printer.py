@@ -1,59 +1,85 @@
 import logging
-import asyncio
 
-from inspect import iscoroutinefunction
 from typing import Optional, Callable
 
+from app.printer_state import PrinterState
+from app.event_bus import EventBus
+
 logger = logging.getLogger(__name__)
 
 class Printer:
     PROGRESS_STEP_SIZE = 0.05
-
-    def __init__(self, data: Optional[dict] = None) -> None:
-        self.data = data or {}
+    # seconds of print time a greater z has to hold (z-hops go back down) and between two layer events (vase mode)
+    LAYER_SETTLE_TIME = 1.0
+    MIN_LAYER_INTERVAL = 2.0
+
+    def __init__(self, data: Optional[dict] = None, event_queue_size: int = 100,
+                 event_overflow: str = 'coalesce') -> None:
+        self.data = PrinterState()
+        if data:
+            self.data.update(data)
         self.state = 'disconnected'
         self.progress = None
-        self._listeners = {}
+        # layer number reported by the slicer (SET_PRINT_STATS_INFO), otherwise the height of the layer
+        self.layer = None
+        self._reset_layer()
+        self._events = EventBus('printer', max_depth=event_queue_size, overflow=event_overflow)
 
+    # an event or a field, e.g. "print_stats.state", callback gets the value as of the event
     def add_listener(self, event: str, callback: Callable) -> None:
-        if event in self._listeners:
-            self._listeners[event].append(callback)
-        else:
-            self._listeners[event] = [callback]
+        self._events.add_listener(event, callback)
+
+    async def close(self) -> None:
+        await self._events.close()
 
     def update(self, data: dict) -> None:
-        for entry in data:
-            if entry == 'configfile':
-                continue
-            if entry not in self.data:
-                self.data[entry] = {}
-            self.data[entry].update(data[entry])
-
-        if 'print_stats' in data:
-            if 'state' in data['print_stats']:
-                self.change_state(data['print_stats']['state'])
-
-        if 'display_status' in data:
+        changes = self.data.update(data)
+
+        if 'print_stats.state' in changes:
+            self.change_state(self.data.print_stats.state)
+
+        if 'print_stats.info' in changes:
+            self._process_layer_info()
+
+        if 'gcode_move.gcode_position' in changes and not self._layer_info:
+            self._process_layer_update()
+
+        if 'display_status.progress' in changes:
             self._process_progress_update()
 
-            if 'message' in data['display_status'] and data['display_status']['message'] is not None:
-                self._process_message()
+        if 'display_status.message' in changes and self.data.display_status.message is not None:
+            self._process_message()
+
+        for field in changes:
+            if self._events.has_listeners(field):
+                section, _, name = field.partition('.')
+                self._invoke_callback(field, self, self.data[section].get(name))
 
     def change_state(self, state: str) -> None:
         if self.state != state:
+            if state == 'printing' and self.state != 'paused':
+                self._reset_layer()
             self.state = state
-            self._invoke_callback('state_changed', self)
+            self._invoke_callback('state_changed', self, state)
 
     def reset(self) -> None:
-        self.data = {}
+        self.data.clear()
         self.state = 'disconnected'
         self.progress = None
+        self._reset_layer()
+
+    def _reset_layer(self) -> None:
+        self.layer = None
+        self._layer_info = False
+        self._layer_time: Optional[float] = None
+        self._candidate_height: Optional[float] = None
+        self._candidate_time = 0.0
 
     def _process_message(self) -> None:
-        self._invoke_callback('message', self)
+        self._invoke_callback('message', self, self.data.display_status.message)
 
     def _process_progress_update(self) -> None:
-        progress = int(self.data['display_status']['progress'] / Printer.PROGRESS_STEP_SIZE) * Printer.PROGRESS_STEP_SIZE
+        progress = int(self.data.display_status.progress / Printer.PROGRESS_STEP_SIZE) * Printer.PROGRESS_STEP_SIZE
 
         if self.progress is None or self.progress > progress:
             self.progress = progress
@@ -61,20 +87,45 @@ class Printer:
             return
         if self.progress < progress:
             self.progress = progress
-            self._invoke_callback('progress_changed', self)
+            self._invoke_callback('progress_changed', self, progress)
 
-    def _invoke_callback(self, event: str, *args, **kwargs) -> None:
-        if event not in self._listeners:
+    def _process_layer_info(self) -> None:
+        layer = (self.data.print_stats.info or {}).get('current_layer')
+        if layer is None:
+            return
+        # the slicer knows better than any z heuristic
+        self._layer_info = True
+        if self.state == 'printing' and (self.layer is None or self.layer < layer):
+            self.layer = layer
+            self._invoke_callback('layer_changed', self, self.layer)
+
+    def _process_layer_update(self) -> None:
+        if self.state != 'printing':
+            return
+
+        # z only grows layer by layer, a greater height is a new layer once it holds for a while:
+        # z-hops go back down, and a vase mode print (z grows all the time) gets an event per interval
+        height = round(self.data.gcode_move.gcode_position[2], 3)
+        now = self.data.print_stats.print_duration or 0.0
+        if self.layer is not None and height <= self.layer:
+            self._candidate_height = None
+            return
+
+        if self._candidate_height is None:
+            self._candidate_height = height
+            self._candidate_time = now
+        else:
+            # a hop is followed by the move down to the next layer
+            self._candidate_height = min(self._candidate_height, height)
+
+        if now - self._candidate_time < Printer.LAYER_SETTLE_TIME:
+            return
+        if self._layer_time is not None and now - self._layer_time < Printer.MIN_LAYER_INTERVAL:
             return
+        self.layer = self._candidate_height
+        self._layer_time = now
+        self._candidate_height = None
+        self._invoke_callback('layer_changed', self, self.layer)
 
-        async def invoke() -> None:
-            for callback in self._listeners[event]:
-                try:
-                    if iscoroutinefunction(callback):
-                        await callback(*args, **kwargs)
-                    else:
-                        callback(*args, **kwargs)
-                except Exception as e:
-                    logger.error(f'got exception during invoke callback ({e})')
-
-        asyncio.ensure_future(invoke())
+    def _invoke_callback(self, event: str, *args) -> None:
+        self._events.emit(event, *args)
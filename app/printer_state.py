@@ -0,0 +1,170 @@
+from typing import Optional, Any, Dict, Set, Iterator
+
+
+# dict-like read access, a field is present once it has a value
+class Section:
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def update(self, name: str, values: dict, changes: Set[str]) -> None:
+        for field, value in values.items():
+            if field in self.__slots__ and getattr(self, field) != value:
+                setattr(self, field, value)
+                changes.add(f'{name}.{field}')
+
+    def get(self, field: str, default: Any = None) -> Any:
+        value = getattr(self, field, None) if field in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.__slots__ and getattr(self, field) is not None
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class GenericSection(Section):
+    __slots__ = ('_values',)
+
+    def clear(self) -> None:
+        self._values = {}
+
+    def update(self, name: str, values: dict, changes: Set[str]) -> None:
+        for field, value in values.items():
+            if self._values.get(field) != value:
+                self._values[field] = value
+                changes.add(f'{name}.{field}')
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return self._values.get(field, default)
+
+    def __getitem__(self, field: str) -> Any:
+        return self._values[field]
+
+    def __contains__(self, field: str) -> bool:
+        return field in self._values
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self._values!r})'
+
+
+class Heater(Section):
+    __slots__ = ('temperature', 'target', 'power', 'pressure_advance', 'smooth_time', 'can_extrude')
+
+
+class Fan(Section):
+    __slots__ = ('speed', 'rpm')
+
+
+class PrintStats(Section):
+    __slots__ = ('filename', 'total_duration', 'print_duration', 'filament_used', 'state', 'message', 'info')
+
+
+class VirtualSdcard(Section):
+    __slots__ = ('file_path', 'progress', 'is_active', 'file_position', 'file_size')
+
+
+class DisplayStatus(Section):
+    __slots__ = ('progress', 'message')
+
+
+class Toolhead(Section):
+    __slots__ = (
+        'position', 'homed_axes', 'print_time', 'estimated_print_time', 'extruder', 'max_velocity', 'max_accel',
+        'max_accel_to_decel', 'square_corner_velocity', 'axis_minimum', 'axis_maximum'
+    )
+
+
+class GcodeMove(Section):
+    __slots__ = (
+        'speed_factor', 'speed', 'extrude_factor', 'absolute_coordinates', 'absolute_extrude', 'homing_origin',
+        'position', 'gcode_position'
+    )
+
+
+class IdleTimeout(Section):
+    __slots__ = ('state', 'printing_time')
+
+
+class PauseResume(Section):
+    __slots__ = ('is_paused',)
+
+
+class Webhooks(Section):
+    __slots__ = ('state', 'state_message')
+
+
+# every update returns the changed fields as "object.field" strings
+class PrinterState:
+    SECTIONS = {
+        'extruder': Heater,
+        'heater_bed': Heater,
+        'fan': Fan,
+        'print_stats': PrintStats,
+        'virtual_sdcard': VirtualSdcard,
+        'display_status': DisplayStatus,
+        'toolhead': Toolhead,
+        'gcode_move': GcodeMove,
+        'idle_timeout': IdleTimeout,
+        'pause_resume': PauseResume,
+        'webhooks': Webhooks
+    }
+
+    # objects not worth keeping in memory
+    IGNORED = ('configfile',)
+
+    __slots__ = tuple(SECTIONS.keys()) + ('_other',)
+
+    def __init__(self) -> None:
+        for name, section_type in PrinterState.SECTIONS.items():
+            setattr(self, name, section_type())
+        self._other: Dict[str, GenericSection] = {}
+
+    def update(self, data: dict) -> Set[str]:
+        changes = set()
+        for name, values in data.items():
+            if name not in PrinterState.IGNORED:
+                self.section(name).update(name, values, changes)
+        return changes
+
+    def clear(self) -> None:
+        for name in PrinterState.SECTIONS:
+            getattr(self, name).clear()
+        self._other.clear()
+
+    def section(self, name: str) -> Section:
+        if name in PrinterState.SECTIONS:
+            return getattr(self, name)
+        if name not in self._other:
+            self._other[name] = GenericSection()
+        return self._other[name]
+
+    def get(self, name: str, default: Optional[Section] = None) -> Optional[Section]:
+        if name in PrinterState.SECTIONS:
+            return getattr(self, name)
+        return self._other.get(name, default)
+
+    def __getitem__(self, name: str) -> Section:
+        section = self.get(name)
+        if section is None:
+            raise KeyError(name)
+        return section
+
+    def __contains__(self, name: str) -> bool:
+        return name in PrinterState.SECTIONS or name in self._other
+
+    def __iter__(self) -> Iterator[str]:
+        yield from PrinterState.SECTIONS
+        yield from self._other
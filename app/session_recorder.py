@@ -0,0 +1,103 @@
+import logging
+import asyncio
+import gzip
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, List, Iterator, Tuple, Iterable, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+
+# lines are "<unix time>\t<direction>\t<frame>", direction is "<" inbound, ">" outbound, "*" connection event;
+# a writer thread flushes them to rotated gzip files
+class SessionRecorder:
+    FLUSH_INTERVAL = 1.0
+    INBOUND = '<'
+    OUTBOUND = '>'
+    EVENT = '*'
+
+    def __init__(self, directory: str, max_size: int, max_files: int) -> None:
+        self._directory = Path(directory)
+        self._max_size = max_size
+        self._max_files = max_files
+        self._lines: List[str] = []
+        self._file: Optional[BinaryIO] = None
+        self._gzip: Optional[gzip.GzipFile] = None
+        self._task = None
+        # a single thread keeps writes ordered even if a flush is cancelled midway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-recorder')
+
+    async def open(self) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._task = asyncio.create_task(self._loop_task())
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await self._task
+        self._task = None
+        await self._flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_file)
+
+    def record(self, direction: str, frame: str) -> None:
+        self._lines.append(f'{time.time():.6f}\t{direction}\t{frame}\n')
+
+    async def _loop_task(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(SessionRecorder.FLUSH_INTERVAL)
+                await self._flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def _flush(self) -> None:
+        if not self._lines:
+            return
+        lines, self._lines = self._lines, []
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, lines)
+
+    def _write(self, lines: List[str]) -> None:
+        try:
+            if self._gzip is None:
+                self._open_file()
+            self._gzip.write(''.join(lines).encode())
+            # sync flush keeps the log readable up to this point if the bot dies
+            self._gzip.flush()
+            if self._file.tell() >= self._max_size:
+                self._close_file()
+        except Exception as e:
+            logger.error(f'failed to write session log ({e})')
+
+    def _open_file(self) -> None:
+        # a file of the same second is appended, gzip members are read as a single stream
+        path = self._directory / f'session-{time.strftime("%Y%m%d-%H%M%S")}.log.gz'
+        self._file = open(path, 'ab')
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode='ab')
+
+        files = sorted(self._directory.glob('session-*.log.gz'))
+        for old_file in files[:max(len(files) - self._max_files, 0)]:
+            old_file.unlink()
+
+    def _close_file(self) -> None:
+        if self._gzip is not None:
+            self._gzip.close()
+            self._file.close()
+        self._gzip = None
+        self._file = None
+
+
+# a file still being written is read up to its last flush
+def read_session_log(paths: Iterable[Path]) -> Iterator[Tuple[float, str, str]]:
+    for path in paths:
+        with gzip.open(path, 'rt') as file:
+            try:
+                for line in file:
+                    timestamp, direction, frame = line.rstrip('\n').split('\t', 2)
+                    yield float(timestamp), direction, frame
+            except EOFError:
+                # not closed yet, the tail after the last flush is incomplete
+                pass
+            except gzip.BadGzipFile as e:
+                logger.warning(f'session log "{path}" is corrupted ({e})')
@@ -0,0 +1,113 @@
+# replay recorded moonraker sessions (record_directory option), e.g.
+# python3 -m app.session_replay /home/pi/klipper-tg-bot-sessions/printer [--speed 1]
+
+import argparse
+import asyncio
+import logging
+import time
+import ujson
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.moonraker import Moonraker
+from app.printer import Printer
+from app.session_recorder import SessionRecorder, read_session_log
+
+logger = logging.getLogger(__name__)
+
+
+# speed 0 replays as fast as possible, otherwise recorded delays are divided by speed
+class SessionReplay:
+    # yield to listener tasks every that many frames when replaying as fast as possible
+    YIELD_INTERVAL = 100
+
+    def __init__(self, moonraker: Moonraker, speed: float = 0.0) -> None:
+        self._moonraker = moonraker
+        self._speed = speed
+        self._subscriptions: Dict[int, str] = {}
+        self.time = 0.0
+        self.frames = 0
+
+    async def run(self, paths: List[Path]) -> None:
+        loop = asyncio.get_running_loop()
+        start_time = None
+        start_loop_time = loop.time()
+        for timestamp, direction, frame in read_session_log(paths):
+            self.time = timestamp
+            if start_time is None:
+                start_time = timestamp
+            if self._speed > 0:
+                delay = start_loop_time + (timestamp - start_time) / self._speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif self.frames % SessionReplay.YIELD_INTERVAL == 0:
+                await asyncio.sleep(0)
+
+            self.frames += 1
+            if direction == SessionRecorder.EVENT:
+                # a disconnect itself doesn't change printer state in the bot, the next connect resets it
+                if frame == 'connected':
+                    await self._moonraker.replay('connected', {})
+            elif direction == SessionRecorder.OUTBOUND:
+                self._track_request(ujson.loads(frame))
+            else:
+                await self._replay_frame(ujson.loads(frame))
+
+    def _track_request(self, data) -> None:
+        for request in data if isinstance(data, list) else [data]:
+            if request.get('method') in ('printer.objects.subscribe', 'printer.objects.query'):
+                self._subscriptions[request['id']] = request['method']
+
+    async def _replay_frame(self, data) -> None:
+        for item in data if isinstance(data, list) else [data]:
+            if 'method' in item:
+                params = item['params'][0] if 'params' in item else {}
+                await self._moonraker.replay(item['method'], params)
+            elif self._subscriptions.pop(item.get('id'), None) and 'result' in item:
+                self._moonraker.printer.update(item['result']['status'])
+
+
+def session_files(paths: List[str]) -> List[Path]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('session-*.log.gz')) if path.is_dir() else [path])
+    return files
+
+
+async def replay(paths: List[str], speed: float, quiet: bool) -> None:
+    # every event matters here, so nothing is coalesced
+    moonraker = Moonraker('replay', event_queue_size=1000000, event_overflow='drop_oldest')
+    session = SessionReplay(moonraker, speed)
+
+    def print_event(event: str):
+        def callback(printer: Printer, value: Any) -> None:
+            if quiet:
+                return
+            print(f'{datetime.fromtimestamp(session.time).isoformat(sep=" ")} {event}: {value}')
+        return callback
+
+    for event in ('state_changed', 'progress_changed', 'layer_changed', 'message'):
+        moonraker.printer.add_listener(event, print_event(event))
+
+    start = time.perf_counter()
+    try:
+        await session.run(session_files(paths))
+        # let listeners drain their queues
+        await asyncio.sleep(0.1)
+    finally:
+        await moonraker.close()
+    print(f'replayed {session.frames} frames in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay recorded moonraker sessions')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='session log files or directories')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay speed, 1 - real time, 0 - max (default)')
+    parser.add_argument('--quiet', action='store_true', help="don't print printer events")
+    parser.add_argument('-d', '--debug', action='store_true', help='print lots of debug data')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if arguments.debug else logging.WARNING)
+    asyncio.run(replay(arguments.paths, arguments.speed, arguments.quiet))
@@ -0,0 +1,38 @@
+import logging
+import asyncio
+
+from typing import Optional, Callable, Awaitable, Union, Any
+
+from aiogram.types import InputFile, Message
+
+logger = logging.getLogger(__name__)
+
+
+def file_id_of(message: Any) -> Optional[str]:
+    if not isinstance(message, Message):
+        # edits of inline messages return True
+        return None
+    if message.photo:
+        return message.photo[-1].file_id
+    if message.video:
+        return message.video.file_id
+    if message.document:
+        return message.document.file_id
+    return None
+
+
+# uploaded by the first send, the others reuse its telegram file_id
+class SharedFile:
+    def __init__(self, file: InputFile) -> None:
+        self._file = file
+        self._file_id: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    async def send(self, send: Callable[[Union[InputFile, str]], Awaitable[Any]]) -> Any:
+        if self._file_id is None:
+            async with self._lock:
+                if self._file_id is None:
+                    result = await send(self._file)
+                    self._file_id = file_id_of(result)
+                    return result
+        return await send(self._file_id)
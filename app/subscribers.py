@@ -0,0 +1,46 @@
+import logging
+
+from typing import List, FrozenSet, Optional
+
+from app.config_reader import ChatConfig
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    __slots__ = ('chat_id', 'events', 'printers', 'commands')
+
+    def __init__(self, chat_id: int, events: FrozenSet[str], printers: Optional[FrozenSet[str]],
+                 commands: bool) -> None:
+        self.chat_id = chat_id
+        self.events = events
+        self.printers = printers
+        self.commands = commands
+
+
+# events are "state", "errors" (error and shutdown states only), "progress" and "messages"
+class SubscriberRegistry:
+    EVENTS = frozenset(('state', 'progress', 'messages', 'errors'))
+
+    def __init__(self, chats: List[ChatConfig]) -> None:
+        self._subscribers: List[Subscriber] = []
+        for chat in chats:
+            events = frozenset(event.strip() for event in chat.events if event.strip())
+            unknown = events - SubscriberRegistry.EVENTS
+            if unknown:
+                raise RuntimeError(f'unknown notification events {", ".join(sorted(unknown))}')
+            printers = frozenset(printer.strip() for printer in chat.printers) if chat.printers else None
+            self._subscribers.append(Subscriber(chat.chat_id, events, printers, chat.commands))
+
+        self.chat_ids = frozenset(subscriber.chat_id for subscriber in self._subscribers)
+        # set lookup for the message filter of every update
+        self.command_chat_ids = frozenset(
+            subscriber.chat_id for subscriber in self._subscribers if subscriber.commands
+        )
+
+    def recipients(self, printer: str, *events: str) -> List[int]:
+        return [
+            subscriber.chat_id for subscriber in self._subscribers
+            if not subscriber.events.isdisjoint(events)
+            and (subscriber.printers is None or printer in subscriber.printers)
+        ]
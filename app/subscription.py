@@ -0,0 +1,40 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+
+# fields required by features merged into one subscription, None is the whole object
+class SubscriptionPlanner:
+    def __init__(self) -> None:
+        self._features: Dict[str, Dict[str, Optional[Set[str]]]] = {}
+        self._plan: Optional[Dict[str, Optional[List[str]]]] = None
+
+    def require(self, feature: str, objects: Dict[str, Optional[Iterable[str]]]) -> bool:
+        self._features[feature] = {
+            name: None if fields is None else set(fields) for name, fields in objects.items()
+        }
+        return self._replan()
+
+    def release(self, feature: str) -> bool:
+        if self._features.pop(feature, None) is None:
+            return False
+        return self._replan()
+
+    def plan(self) -> Dict[str, Optional[List[str]]]:
+        if self._plan is None:
+            self._replan()
+        return self._plan
+
+    def _replan(self) -> bool:
+        merged: Dict[str, Optional[Set[str]]] = {}
+        for objects in self._features.values():
+            for name, fields in objects.items():
+                if name in merged and merged[name] is None:
+                    continue
+                if fields is None:
+                    merged[name] = None
+                else:
+                    merged.setdefault(name, set()).update(fields)
+
+        plan = {name: None if fields is None else sorted(fields) for name, fields in sorted(merged.items())}
+        changed = plan != self._plan
+        self._plan = plan
+        return changed
@@ -0,0 +1,82 @@
+import logging
+import asyncio
+import time
+
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from app.config_reader import TelemetryConfig
+from app.moonraker import Moonraker
+
+logger = logging.getLogger(__name__)
+
+
+# fixed size ring buffers, one array per channel, missing values are NaN
+class Telemetry:
+    CHANNELS = {
+        'extruder': ('extruder', 'temperature'),
+        'extruder_target': ('extruder', 'target'),
+        'bed': ('heater_bed', 'temperature'),
+        'bed_target': ('heater_bed', 'target'),
+        'fan': ('fan', 'speed'),
+        'speed': ('gcode_move', 'speed'),
+    }
+
+    def __init__(self, config: TelemetryConfig, moonraker: Moonraker) -> None:
+        self._config = config
+        self._moonraker = moonraker
+        self._printer = moonraker.printer
+        self._capacity = max(1, int(config.history * 60 / config.resolution))
+        self._times = array('d', [0.0]) * self._capacity
+        self._values = {name: array('f', [float('nan')]) * self._capacity for name in Telemetry.CHANNELS}
+        self._head = 0
+        self._count = 0
+        self._task = None
+
+    async def open(self) -> None:
+        if self._config.enabled:
+            await self._moonraker.require_fields('telemetry', Telemetry.fields())
+            self._task = asyncio.create_task(self._loop_task())
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await self._task
+        self._task = None
+
+    @staticmethod
+    def fields() -> Dict[str, List[str]]:
+        fields: Dict[str, List[str]] = {}
+        for section, field in Telemetry.CHANNELS.values():
+            fields.setdefault(section, []).append(field)
+        return fields
+
+    def record(self, timestamp: float) -> None:
+        data = self._printer.data
+        online = self._printer.state != 'disconnected'
+        for name, (section, field) in Telemetry.CHANNELS.items():
+            value = data[section].get(field) if online else None
+            self._values[name][self._head] = float('nan') if value is None else value
+        self._times[self._head] = timestamp
+        self._head = (self._head + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    # copies in chronological order, safe to use from other threads
+    def series(self, duration: float) -> Tuple[array, Dict[str, array]]:
+        def ordered(buffer: array) -> array:
+            if self._count < self._capacity:
+                return buffer[:self._count]
+            return buffer[self._head:] + buffer[:self._head]
+
+        times = ordered(self._times)
+        begin = bisect_left(times, time.time() - duration)
+        return times[begin:], {name: ordered(values)[begin:] for name, values in self._values.items()}
+
+    async def _loop_task(self) -> None:
+        try:
+            while True:
+                self.record(time.time())
+                await asyncio.sleep(self._config.resolution)
+        except asyncio.CancelledError:
+            pass
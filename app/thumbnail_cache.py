@@ -0,0 +1,102 @@
+import logging
+import asyncio
+import hashlib
+import os
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+# thumbnails without modification time never go to disk, there is no way to invalidate them there
+class ThumbnailCache:
+    def __init__(self, max_size: int, directory: Optional[str] = None, max_disk_size: int = 0) -> None:
+        self._max_size = max_size
+        self._size = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._directory = Path(directory) if directory else None
+        self._max_disk_size = max_disk_size
+        if self._directory:
+            self._directory.mkdir(parents=True, exist_ok=True)
+
+    async def get(self, path: str, modified: Optional[float]) -> Optional[bytes]:
+        key = self._key(path, modified)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if self._directory is None or modified is None:
+            return None
+
+        data = await asyncio.get_running_loop().run_in_executor(None, self._read_file, key)
+        if data is not None:
+            self._put_memory(key, data)
+        return data
+
+    async def put(self, path: str, modified: Optional[float], data: bytes) -> None:
+        key = self._key(path, modified)
+        self._put_memory(key, data)
+        if self._directory is not None and modified is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_file, key, data)
+
+    # a changed gcode file, directory or the thumbnail itself
+    def invalidate(self, path: str) -> None:
+        directory, _, name = path.rpartition('/')
+        stem = name.rsplit('.', 1)[0]
+        prefixes = (
+            f'{path}:',
+            f'{path}/',
+            f'{directory}/.thumbs/{stem}' if directory else f'.thumbs/{stem}'
+        )
+        for key in [key for key in self._entries if key.startswith(prefixes)]:
+            self._size -= len(self._entries.pop(key))
+        # files on disk are named by hash and keyed by modification time, stale ones get evicted eventually
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+
+    def _key(self, path: str, modified: Optional[float]) -> str:
+        return f'{path}:{modified}'
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        if len(data) > self._max_size:
+            return
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self._max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _file_path(self, key: str) -> Path:
+        return self._directory / f'{hashlib.sha1(key.encode()).hexdigest()}.png'
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        path = self._file_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f'failed to read cached thumbnail "{path}" ({e})')
+            return None
+
+    def _write_file(self, key: str, data: bytes) -> None:
+        try:
+            self._file_path(key).write_bytes(data)
+
+            # evict least recently used files
+            files = sorted(self._directory.iterdir(), key=lambda file: file.stat().st_mtime)
+            total_size = sum(file.stat().st_size for file in files)
+            while files and total_size > self._max_disk_size:
+                file = files.pop(0)
+                total_size -= file.stat().st_size
+                file.unlink()
+        except Exception as e:
+            logger.error(f'failed to write cached thumbnail ({e})')
@@ -0,0 +1,145 @@
+import logging
+import asyncio
+import os
+import shutil
+
+from pathlib import Path
+from typing import Optional, Dict, List
+
+from app.config_reader import TimelapseConfig
+from app.webcam import Webcam
+
+logger = logging.getLogger(__name__)
+
+
+# frames go straight to disk, the encode runs with the lowest CPU priority
+class Timelapse:
+    READ_CHUNK_SIZE = 65536
+    # z position for layer detection when the slicer doesn't report layers
+    FIELDS = {'gcode_move': ['gcode_position']}
+
+    def __init__(self, config: TimelapseConfig, webcam: Webcam, name: str) -> None:
+        self._config = config
+        self._webcam = webcam
+        self._directory = Path(config.directory) / name
+        self._active = False
+        self._frame_count = 0
+        self._interval_task = None
+
+    async def close(self) -> None:
+        await self._stop()
+
+    def fields(self) -> Dict[str, List[str]]:
+        if self._config.enabled and self._config.mode == 'layer':
+            return Timelapse.FIELDS
+        return {}
+
+    # returns path to the rendered video when print completes
+    async def update_state(self, state: str) -> Optional[Path]:
+        if state == 'printing':
+            if not self._active:
+                await self._start()
+        elif state == 'complete':
+            if self._active:
+                await self._stop()
+                return await self._render()
+        elif state in ('cancelled', 'error', 'standby'):
+            if self._active:
+                await self._stop()
+                self.cleanup()
+        return None
+
+    async def on_layer_changed(self) -> None:
+        if self._config.mode == 'layer':
+            await self._capture()
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    async def _start(self) -> None:
+        logger.info('timelapse started')
+        self.cleanup()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._frame_count = 0
+        self._active = True
+        if self._config.mode == 'interval':
+            self._interval_task = asyncio.create_task(self._interval_loop_task())
+
+    async def _stop(self) -> None:
+        self._active = False
+        if self._interval_task and not self._interval_task.done():
+            self._interval_task.cancel()
+            await self._interval_task
+        self._interval_task = None
+
+    async def _interval_loop_task(self) -> None:
+        try:
+            while True:
+                await self._capture()
+                await asyncio.sleep(self._config.interval)
+        except asyncio.CancelledError:
+            pass
+
+    def _frame_path(self, index: int) -> Path:
+        return self._directory / f'frame_{index:06d}.jpg'
+
+    async def _capture(self) -> None:
+        if not self._active:
+            return
+
+        image = await self._webcam.get_image()
+        if image is None or not self._active:
+            return
+
+        path = self._frame_path(self._frame_count)
+        self._frame_count += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, path.write_bytes, image)
+        except Exception as e:
+            logger.error(f'failed to write timelapse frame "{path}" ({e})')
+
+    async def _render(self) -> Optional[Path]:
+        if self._frame_count == 0:
+            logger.warning('timelapse has no frames')
+            return None
+
+        output = self._directory / 'timelapse.mp4'
+        args = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'image2pipe', '-framerate', str(self._config.fps), '-c:v', 'mjpeg', '-i', '-',
+            '-an', '-c:v', 'libx264', '-crf', str(self._config.crf), '-pix_fmt', 'yuv420p',
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-movflags', '+faststart', str(output)
+        ]
+        logger.info(f'rendering timelapse from {self._frame_count} frames')
+
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            preexec_fn=lambda: os.nice(19)
+        )
+
+        # feed frames one by one, only a single chunk is held in memory
+        stderr_task = asyncio.create_task(process.stderr.read())
+        try:
+            loop = asyncio.get_running_loop()
+            for index in range(self._frame_count):
+                path = self._frame_path(index)
+                if not path.exists():
+                    continue
+                with path.open('rb') as file:
+                    while chunk := await loop.run_in_executor(None, file.read, Timelapse.READ_CHUNK_SIZE):
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+            process.stdin.close()
+        except Exception as e:
+            logger.error(f'failed to feed timelapse frames ({e})')
+            if process.returncode is None:
+                process.kill()
+
+        await process.wait()
+        stderr = await stderr_task
+
+        if process.returncode != 0:
+            logger.error(f'ffmpeg timelapse error ({stderr})')
+            return None
+
+        return output
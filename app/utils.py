@@ -19,29 +19,29 @@ def format_fillament_length(value: float) -> str:
 
 def create_status_text(printer: Printer) -> str:
     data = printer.data
-    state = data['print_stats']['state']
+    state = data.print_stats.state
 
     text = (
         f'\N{White Heavy Check Mark} <i>state:</i> <b>{printer.state}</b>\n'
     )
 
-    extruder_temperature = data['extruder']['temperature']
-    extruder_target = data['extruder']['target']
+    extruder_temperature = data.extruder.temperature
+    extruder_target = data.extruder.target
     text += (
         f'\N{Thermometer} <i>extruder:</i> <b>{extruder_temperature:.2f}</b>\N{Degree Celsius} ({extruder_target:.2f}\N{Degree Celsius})\n'
     )
 
-    bed_temperature = data['heater_bed']['temperature']
-    bed_target = data['heater_bed']['target']
+    bed_temperature = data.heater_bed.temperature
+    bed_target = data.heater_bed.target
     text += (
         f'\N{Thermometer} <i>bed:</i> <b>{bed_temperature:.2f}</b>\N{Degree Celsius} ({bed_target:.2f}\N{Degree Celsius})\n'
     )
 
     if state in ('printing', 'complete'):
-        filename = data['print_stats']['filename']
-        filament_used = data['print_stats']['filament_used']
-        print_duration = data['print_stats']['print_duration']
-        progress = data['virtual_sdcard']['progress']
+        filename = data.print_stats.filename
+        filament_used = data.print_stats.filament_used
+        print_duration = data.print_stats.print_duration
+        progress = data.virtual_sdcard.progress
 
         estimated_print_duration = print_duration * (1 / progress - 1)
 
@@ -1,18 +1,23 @@
 import logging
 import asyncio
+import aiohttp
+import os
+import re
+import struct
+import ujson
 
-from typing import Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple, Deque, Callable, Awaitable, AsyncIterator
 
-from app.config_reader import config
+from app.config_reader import WebcamConfig
+from app.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
-async def ffmpeg_execute_with_args(args: str) -> Optional[bytes]:
-    if config.webcam.input is None:
-        return None
-
-    cmd_line = f'ffmpeg -hide_banner -loglevel error -y -i {config.webcam.input} {args} -'
+async def ffmpeg_execute_with_args(input: str, args: str) -> Optional[bytes]:
+    cmd_line = f'ffmpeg -hide_banner -loglevel error -y -i {input} {args} -'
 
     logger.debug(f'ffmpeg_execute_with_args cmd_line: "{cmd_line}"')
 
@@ -28,11 +33,697 @@ async def ffmpeg_execute_with_args(args: str) -> Optional[bytes]:
     return stdout
 
 
-async def get_webcam_image() -> Optional[bytes]:
-    return await ffmpeg_execute_with_args('-frames:v 1 -c:v png -f image2pipe')
+# a long-running process never blocks on a full stderr pipe
+async def read_tail(stream: asyncio.StreamReader, max_size: int = 4096) -> bytes:
+    tail = b''
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return tail
+        tail = (tail + chunk)[-max_size:]
+
+
+def is_device_input(input: str) -> bool:
+    # capture devices (v4l2) are opened by one process at a time
+    return input.startswith('/dev/')
+
+
+class VideoSource:
+    __slots__ = ('codec', 'width', 'height', 'fps')
+
+    def __init__(self, codec: Optional[str], width: Optional[int], height: Optional[int],
+                 fps: Optional[float]) -> None:
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    def __repr__(self) -> str:
+        return f'VideoSource(codec={self.codec}, size={self.width}x{self.height}, fps={self.fps})'
 
 
-async def get_webcam_video(duration: int=5) -> Optional[bytes]:
-    return await ffmpeg_execute_with_args(
-        f'-t {duration} -an -c:v libx264 -crf {config.webcam.crf} -movflags frag_keyframe+empty_moov -f mp4 -pix_fmt yuv420p'
+def parse_frame_rate(value: Optional[str]) -> Optional[float]:
+    # ffprobe reports rates as fractions, "0/0" if unknown
+    try:
+        numerator, denominator = (value or '').split('/')
+        return float(numerator) / float(denominator) if float(denominator) else None
+    except ValueError:
+        return None
+
+
+async def probe_video_source(input: str, timeout: float) -> Optional[VideoSource]:
+    args = [
+        'ffprobe', '-hide_banner', '-loglevel', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate', '-of', 'json', input
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.error(f'ffprobe timed out ({input})')
+        return None
+
+    if process.returncode != 0:
+        logger.error(f'ffprobe error ({stderr})')
+        return None
+
+    streams = ujson.loads(stdout).get('streams')
+    if not streams:
+        return None
+    stream = streams[0]
+    return VideoSource(
+        codec=stream.get('codec_name'),
+        width=stream.get('width'),
+        height=stream.get('height'),
+        fps=parse_frame_rate(stream.get('avg_frame_rate')) or parse_frame_rate(stream.get('r_frame_rate'))
+    )
+
+
+# H.264 is copied with the "auto" profile, with duration the output is cut to fit video_max_size
+def make_video_args(source: Optional[VideoSource], config: WebcamConfig, duration: Optional[float] = None,
+                    keyframe_interval: Optional[float] = None) -> List[str]:
+    profile = config.video_profile
+    if profile == 'auto':
+        profile = 'copy' if source is not None and source.codec == 'h264' else 'encode'
+
+    if profile == 'copy':
+        args = ['-c:v', 'copy']
+    else:
+        args = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(config.crf), '-pix_fmt', 'yuv420p']
+        if source is not None and source.height is not None and source.height > config.video_max_height:
+            video_filter = f'scale=-2:{config.video_max_height}'
+            if source.fps is None or source.fps > config.video_max_fps:
+                video_filter += f',fps={config.video_max_fps:g}'
+            args += ['-vf', video_filter]
+        if duration:
+            # kbit/s, a tenth of the budget is left for the container
+            bitrate = int(config.video_max_size * 1024 * 1024 * 8 * 0.9 / duration / 1000)
+            args += ['-maxrate', f'{bitrate}k', '-bufsize', f'{bitrate * 2}k']
+        if keyframe_interval:
+            args += ['-force_key_frames', f'expr:gte(t,n_forced*{keyframe_interval})']
+
+    if duration:
+        args += ['-fs', str(int(config.video_max_size * 1024 * 1024))]
+    return args
+
+
+# the incomplete tail is left in the buffer
+def split_jpeg_frames(buffer: bytearray) -> List[bytes]:
+    frames = []
+    while True:
+        begin = buffer.find(b'\xff\xd8')
+        if begin < 0:
+            # keep a possible half of the SOI marker
+            del buffer[:max(len(buffer) - 1, 0)]
+            break
+        end = buffer.find(b'\xff\xd9', begin + 2)
+        if end < 0:
+            del buffer[:begin]
+            break
+        frames.append(bytes(buffer[begin:end + 2]))
+        del buffer[:end + 2]
+    return frames
+
+
+# started on demand and stopped after idle_timeout seconds without requests (zero - never)
+class FrameGrabber:
+    RESTART_INTERVAL = 5.0
+    FRAME_TIMEOUT = 15.0
+    READ_CHUNK_SIZE = 65536
+
+    def __init__(self, input: str, fps: float, idle_timeout: float) -> None:
+        self._input = input
+        self._fps = fps
+        self._idle_timeout = idle_timeout
+        self._task = None
+        self._frame: Optional[bytes] = None
+        self._frame_time = 0.0
+        self._next_frame: Optional[asyncio.Future] = None
+        self._last_request_time = 0.0
+        self._suspended = 0
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    async def get_frame(self, max_age: float) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        self._last_request_time = loop.time()
+
+        if self._frame is not None and loop.time() - self._frame_time <= max_age:
+            return self._frame
+
+        try:
+            return await asyncio.wait_for(self._wait_frame(), FrameGrabber.FRAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f'no frame from "{self._input}" within {FrameGrabber.FRAME_TIMEOUT}s')
+        return None
+
+    @asynccontextmanager
+    async def suspended(self) -> AsyncIterator[None]:
+        self._suspended += 1
+        self._resumed.clear()
+        try:
+            await self.close()
+            yield
+        finally:
+            self._suspended -= 1
+            if not self._suspended:
+                self._resumed.set()
+                if self._next_frame and not self._next_frame.done():
+                    # requests made before the suspension are still waiting
+                    self._start()
+
+    async def close(self) -> None:
+        if not self._task or self._task.done():
+            return
+
+        self._task.cancel()
+        await self._task
+
+    async def _wait_frame(self) -> Optional[bytes]:
+        await self._resumed.wait()
+        if self._next_frame is None or self._next_frame.done():
+            self._next_frame = asyncio.get_running_loop().create_future()
+        future = self._next_frame
+        self._start()
+        return await asyncio.shield(future)
+
+    def _start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._loop_task())
+
+    def _idle(self) -> bool:
+        if self._idle_timeout <= 0:
+            return False
+        return asyncio.get_running_loop().time() - self._last_request_time > self._idle_timeout
+
+    def _set_frame(self, frame: bytes) -> None:
+        self._frame = frame
+        self._frame_time = asyncio.get_running_loop().time()
+        if self._next_frame and not self._next_frame.done():
+            self._next_frame.set_result(frame)
+
+    async def _loop_task(self) -> None:
+        try:
+            while not self._idle():
+                loop = asyncio.get_running_loop()
+                start_time = loop.time()
+
+                try:
+                    returncode = await self._capture()
+                except Exception as e:
+                    logger.error(f'failed to run capture process ({e})')
+                    returncode = -1
+
+                if self._idle():
+                    break
+
+                if returncode != 0:
+                    logger.warning(
+                        f'capture process exited ({returncode}), restart in {FrameGrabber.RESTART_INTERVAL}s'
+                    )
+                    await asyncio.sleep(FrameGrabber.RESTART_INTERVAL)
+                else:
+                    # input ended by itself (e.g. a single image url), poll it again at the capture rate
+                    await asyncio.sleep(max(1.0 / self._fps - (loop.time() - start_time), 0.0))
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            # suspended requests get the frame of the restarted process
+            if self._next_frame and not self._next_frame.done() and not self._suspended:
+                self._next_frame.set_result(None)
+
+    async def _capture(self) -> int:
+        args = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', self._input,
+            '-an', '-vf', f'fps={self._fps}', '-c:v', 'mjpeg', '-q:v', '3', '-f', 'image2pipe', '-'
+        ]
+        logger.debug(f'starting capture process: {args}')
+
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stderr = asyncio.create_task(read_tail(process.stderr))
+
+        try:
+            buffer = bytearray()
+            while not self._idle():
+                chunk = await process.stdout.read(FrameGrabber.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                frames = split_jpeg_frames(buffer)
+                if frames:
+                    self._set_frame(frames[-1])
+
+        finally:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            stderr = await stderr
+
+        if process.returncode > 0:
+            logger.error(f'ffmpeg capture error ({stderr})')
+
+        return process.returncode
+
+
+def parse_part_headers(data: bytes) -> Dict[str, str]:
+    headers = {}
+    for line in data.decode('latin-1').splitlines():
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+async def read_multipart_frame(response: aiohttp.ClientResponse, max_size: int) -> bytes:
+    match = re.search(r'boundary="?([^";]+)"?', response.headers.get('Content-Type', ''))
+    if match is None:
+        raise RuntimeError('multipart boundary not found')
+    # some streamers put leading dashes into the boundary parameter
+    delimiter = b'--' + match.group(1).lstrip('-').encode('latin-1')
+
+    buffer = bytearray()
+    async for chunk in response.content.iter_any():
+        buffer += chunk
+        if len(buffer) > max_size:
+            raise RuntimeError('frame too large')
+
+        begin = buffer.find(delimiter)
+        if begin < 0:
+            continue
+        headers_end = buffer.find(b'\r\n\r\n', begin)
+        if headers_end < 0:
+            continue
+        headers = parse_part_headers(buffer[begin + len(delimiter):headers_end])
+        body_begin = headers_end + 4
+
+        if 'content-length' in headers:
+            body_end = body_begin + int(headers['content-length'])
+            if len(buffer) < body_end:
+                continue
+        else:
+            body_end = buffer.find(delimiter, body_begin)
+            if body_end < 0:
+                continue
+
+        return bytes(buffer[body_begin:body_end]).rstrip(b'\r\n')
+
+    raise RuntimeError('stream closed before first frame')
+
+
+# images are passed through as is, concurrent requests share one http request
+class HttpFrameGrabber:
+    REQUEST_TIMEOUT = 10.0
+    MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, url: str) -> None:
+        self._url = url
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._frame: Optional[bytes] = None
+        self._frame_time = 0.0
+        self._task = None
+
+    async def get_frame(self, max_age: float) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        if self._frame is not None and loop.time() - self._frame_time <= max_age:
+            return self._frame
+
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._fetch())
+        return await asyncio.shield(self._task)
+
+    async def close(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _fetch(self) -> Optional[bytes]:
+        if not self._session or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=HttpFrameGrabber.REQUEST_TIMEOUT)
+            )
+
+        try:
+            async with self._session.get(self._url) as response:
+                if response.status != 200:
+                    raise RuntimeError(f'invalid response code {response.status}')
+                if response.content_type.startswith('multipart/'):
+                    frame = await read_multipart_frame(response, HttpFrameGrabber.MAX_FRAME_SIZE)
+                elif response.content_type.startswith('image/'):
+                    frame = await response.read()
+                else:
+                    raise RuntimeError(f'unsupported content type "{response.content_type}"')
+        except Exception as e:
+            logger.error(f'failed to get "{self._url}" ({e})')
+            return None
+
+        self._frame = frame
+        self._frame_time = asyncio.get_running_loop().time()
+        return frame
+
+
+# the incomplete tail is left in the buffer
+def split_mp4_boxes(buffer: bytearray) -> List[Tuple[bytes, bytes]]:
+    boxes = []
+    while len(buffer) >= 8:
+        size, type = struct.unpack_from('>I4s', buffer)
+        header_size = 8
+        if size == 1:
+            if len(buffer) < 16:
+                break
+            size, = struct.unpack_from('>Q', buffer, 8)
+            header_size = 16
+        if size < header_size:
+            raise RuntimeError(f'invalid mp4 box size {size}')
+        if len(buffer) < size:
+            break
+        boxes.append((type, bytes(buffer[:size])))
+        del buffer[:size]
+    return boxes
+
+
+# fragmented MP4, a clip is the init segment followed by the newest fragments, so nothing is encoded on request;
+# with snapshot_fps the same process serves snapshots, the input is opened once
+class VideoRecorder:
+    RESTART_INTERVAL = 5.0
+    READ_CHUNK_SIZE = 65536
+    FRAME_TIMEOUT = 15.0
+    SEGMENT_TIMEOUT = 15.0
+
+    def __init__(self, input: str, duration: float, max_size: int, segment_duration: float,
+                 video_args: Callable[[], Awaitable[List[str]]], snapshot_fps: float = 0.0) -> None:
+        self._input = input
+        self._duration = duration
+        self._max_size = max_size
+        self._segment_duration = segment_duration
+        self._video_args = video_args
+        self._snapshot_fps = snapshot_fps
+        self._task = None
+        self._init_segment: Optional[bytes] = None
+        self._segments: Deque[Tuple[float, bytes]] = deque()
+        self._size = 0
+        self._frame: Optional[bytes] = None
+        self._frame_time = 0.0
+        self._next_frame: Optional[asyncio.Future] = None
+        self._next_segment: Optional[asyncio.Future] = None
+
+    async def open(self) -> None:
+        if self._task and not self._task.done():
+            raise Exception('video recorder already running')
+        self._task = asyncio.create_task(self._loop_task())
+
+    async def close(self) -> None:
+        if not self._task or self._task.done():
+            return
+
+        self._task.cancel()
+        await self._task
+
+    def get_video(self, duration: float) -> Optional[bytes]:
+        if self._init_segment is None or not self._segments:
+            return None
+
+        # take fragments received within the duration plus the one before to cover the beginning
+        since = asyncio.get_running_loop().time() - duration
+        count = 0
+        for received_time, _ in reversed(self._segments):
+            count += 1
+            if received_time < since:
+                break
+
+        segments = list(self._segments)[-count:]
+        return b''.join([self._init_segment] + [data for _, data in segments])
+
+    async def wait_video(self, duration: float) -> Optional[bytes]:
+        video = self.get_video(duration)
+        if video is not None:
+            return video
+
+        if self._next_segment is None or self._next_segment.done():
+            self._next_segment = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._next_segment), VideoRecorder.SEGMENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f'no video from recorder of "{self._input}" within {VideoRecorder.SEGMENT_TIMEOUT}s')
+            return None
+        return self.get_video(duration)
+
+    async def get_frame(self, max_age: float) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        if self._frame is not None and loop.time() - self._frame_time <= max_age:
+            return self._frame
+
+        if self._next_frame is None or self._next_frame.done():
+            self._next_frame = loop.create_future()
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._next_frame), VideoRecorder.FRAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f'no frame from video recorder of "{self._input}" within {VideoRecorder.FRAME_TIMEOUT}s')
+        return None
+
+    def _set_frame(self, frame: bytes) -> None:
+        self._frame = frame
+        self._frame_time = asyncio.get_running_loop().time()
+        if self._next_frame and not self._next_frame.done():
+            self._next_frame.set_result(frame)
+
+    def _add_segment(self, data: bytes) -> None:
+        now = asyncio.get_running_loop().time()
+        self._segments.append((now, data))
+        self._size += len(data)
+
+        while len(self._segments) > 1:
+            received_time, oldest = self._segments[0]
+            if self._size <= self._max_size and received_time >= now - self._duration - self._segment_duration:
+                break
+            self._segments.popleft()
+            self._size -= len(oldest)
+
+        if self._init_segment is not None and self._next_segment and not self._next_segment.done():
+            self._next_segment.set_result(None)
+
+    def _reset(self) -> None:
+        self._init_segment = None
+        self._segments.clear()
+        self._size = 0
+
+    async def _loop_task(self) -> None:
+        try:
+            while True:
+                try:
+                    returncode = await self._record()
+                    logger.warning(f'video recorder process exited ({returncode})')
+                except Exception as e:
+                    logger.error(f'failed to run video recorder process ({e})')
+                self._reset()
+                await asyncio.sleep(VideoRecorder.RESTART_INTERVAL)
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            self._reset()
+
+    async def _record(self) -> int:
+        args = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', self._input, '-an', *await self._video_args(),
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', '-'
+        ]
+        snapshot_pipe = None
+        if self._snapshot_fps > 0:
+            # second output of the same process, the child writes to the inherited pipe fd
+            snapshot_pipe = os.pipe()
+            args += [
+                '-an', '-vf', f'fps={self._snapshot_fps}', '-c:v', 'mjpeg', '-q:v', '3', '-f', 'image2pipe',
+                f'pipe:{snapshot_pipe[1]}'
+            ]
+        logger.debug(f'starting video recorder process: {args}')
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                pass_fds=(snapshot_pipe[1],) if snapshot_pipe else ()
+            )
+        except Exception:
+            if snapshot_pipe:
+                os.close(snapshot_pipe[0])
+            raise
+        finally:
+            if snapshot_pipe:
+                os.close(snapshot_pipe[1])
+        stderr = asyncio.create_task(read_tail(process.stderr))
+        snapshots = asyncio.create_task(self._read_snapshots(snapshot_pipe[0])) if snapshot_pipe else None
+
+        try:
+            buffer = bytearray()
+            init_segment = b''
+            fragment = b''
+            while True:
+                chunk = await process.stdout.read(VideoRecorder.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                for type, data in split_mp4_boxes(buffer):
+                    if type in (b'ftyp', b'moov'):
+                        init_segment += data
+                        if type == b'moov':
+                            self._init_segment = init_segment
+                    elif type == b'moof':
+                        fragment = data
+                    elif type == b'mdat' and fragment:
+                        self._add_segment(fragment + data)
+                        fragment = b''
+
+        finally:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            stderr = await stderr
+            if snapshots:
+                # ends on EOF of the pipe once the process is gone
+                await snapshots
+
+        if process.returncode > 0:
+            logger.error(f'ffmpeg video recorder error ({stderr})')
+
+        return process.returncode
+
+    async def _read_snapshots(self, fd: int) -> None:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, 'rb', buffering=0)
+        )
+        try:
+            buffer = bytearray()
+            while True:
+                chunk = await reader.read(VideoRecorder.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                frames = split_jpeg_frames(buffer)
+                if frames:
+                    self._set_frame(frames[-1])
+        finally:
+            transport.close()
+
+
+class Webcam:
+    # a failed probe (e.g. camera not connected yet) is retried after that many seconds
+    PROBE_RETRY_INTERVAL = 60.0
+    PROBE_TIMEOUT = 15.0
+
+    def __init__(self, config: WebcamConfig) -> None:
+        self._config = config
+        self._grabber = None
+        self._recorder = None
+        self._source: Optional[VideoSource] = None
+        self._probe_time: Optional[float] = None
+        self._probe_lock = asyncio.Lock()
+        if config.input is None:
+            return
+
+        if config.video_profile not in ('auto', 'copy', 'encode'):
+            raise RuntimeError(f'unknown webcam video profile "{config.video_profile}"')
+
+        capture = config.capture
+        if capture == 'auto':
+            capture = 'http' if config.input.startswith(('http://', 'https://')) else 'ffmpeg'
+        if capture not in ('http', 'ffmpeg'):
+            raise RuntimeError(f'unknown webcam capture mode "{config.capture}"')
+
+        if config.video_buffer > 0:
+            async def recorder_video_args() -> List[str]:
+                return make_video_args(await self._probe(), config, keyframe_interval=config.video_segment)
+
+            self._recorder = VideoRecorder(
+                config.input,
+                duration=config.video_buffer,
+                max_size=config.video_buffer_size * 1024 * 1024,
+                segment_duration=config.video_segment,
+                video_args=recorder_video_args,
+                # a second ffmpeg couldn't open the input held by the recorder, snapshots come from the recorder
+                snapshot_fps=config.capture_fps if capture == 'ffmpeg' else 0.0
+            )
+
+        if capture == 'http':
+            self._grabber = HttpFrameGrabber(config.input)
+        elif self._recorder:
+            self._grabber = self._recorder
+        else:
+            self._grabber = FrameGrabber(config.input, fps=config.capture_fps, idle_timeout=config.idle_timeout)
+
+    async def open(self) -> None:
+        if self._recorder:
+            await self._recorder.open()
+
+    async def close(self) -> None:
+        if self._grabber and self._grabber is not self._recorder:
+            await self._grabber.close()
+        if self._recorder:
+            await self._recorder.close()
+
+    async def get_image(self) -> Optional[bytes]:
+        if self._grabber is None:
+            return None
+        start = metrics.now()
+        frame = await self._grabber.get_frame(max_age=self._config.max_age)
+        metrics.histogram('webcam_capture_seconds', kind='image').observe_since(start)
+        return frame
+
+    async def get_video(self, duration: int = 5) -> Optional[bytes]:
+        if self._config.input is None:
+            return None
+        if self._recorder:
+            video = await self._recorder.wait_video(duration)
+            if video is not None:
+                return video
+            if is_device_input(self._config.input):
+                # the device is held by the recorder, a one-off capture couldn't open it
+                return None
+            logger.warning('video buffer is empty, capturing video')
+        start = metrics.now()
+        video_args = ' '.join(make_video_args(await self._probe(), self._config, duration=duration))
+        async with self._exclusive():
+            video = await ffmpeg_execute_with_args(
+                self._config.input, f'-t {duration} -an {video_args} -movflags frag_keyframe+empty_moov -f mp4'
+            )
+        metrics.histogram('webcam_capture_seconds', kind='video').observe_since(start)
+        return video
+
+    async def _probe(self) -> Optional[VideoSource]:
+        async with self._probe_lock:
+            now = asyncio.get_running_loop().time()
+            if self._source is None and (
+                self._probe_time is None or now - self._probe_time >= Webcam.PROBE_RETRY_INTERVAL
+            ):
+                self._probe_time = now
+                try:
+                    async with self._exclusive():
+                        self._source = await probe_video_source(self._config.input, Webcam.PROBE_TIMEOUT)
+                except Exception as e:
+                    logger.error(f'failed to probe webcam input ({e})')
+                if self._source is not None:
+                    logger.info(f'webcam input: {self._source}')
+            return self._source
+
+    # release the capture device for a one-off ffmpeg / ffprobe run
+    @asynccontextmanager
+    async def _exclusive(self) -> AsyncIterator[None]:
+        if isinstance(self._grabber, FrameGrabber) and is_device_input(self._config.input):
+            async with self._grabber.suspended():
+                yield
+        else:
+            yield
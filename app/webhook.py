@@ -0,0 +1,69 @@
+import logging
+import asyncio
+import secrets
+import signal
+
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+# requests without the secret token are rejected, a random secret is used when none is configured
+class WebhookServer:
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, url: str, listen: str, path: str,
+                 secret: Optional[str]) -> None:
+        if not url:
+            raise ValueError('webhook_url is required in webhook mode')
+        self._dispatcher = dispatcher
+        self._bot = bot
+        self._url = url
+        self._listen = listen
+        self._path = path
+        # without a secret anyone reaching the endpoint could forge updates from the configured chat
+        self._secret = secret or secrets.token_urlsafe(32)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def open(self) -> None:
+        app = web.Application()
+        # dispatcher shutdown goes first, it still sends messages before the handler closes the bot session
+        setup_application(app, self._dispatcher, bot=self._bot)
+        SimpleRequestHandler(self._dispatcher, self._bot, secret_token=self._secret).register(app, path=self._path)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        # emits dispatcher startup
+        await self._runner.setup()
+        if self._listen.startswith('unix:'):
+            site = web.UnixSite(self._runner, self._listen[len('unix:'):])
+        else:
+            host, port = self._listen.rsplit(':', 1)
+            site = web.TCPSite(self._runner, host, int(port))
+        await site.start()
+        logger.info(f'listening for webhook updates on {self._listen}{self._path}')
+
+        await self._bot.set_webhook(
+            self._url, secret_token=self._secret, drop_pending_updates=True,
+            allowed_updates=self._dispatcher.resolve_used_update_types()
+        )
+
+    async def close(self) -> None:
+        if self._runner:
+            # emits dispatcher shutdown
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        try:
+            await self.open()
+            await stop.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            await self.close()
@@ -0,0 +1,259 @@
+# usage: python -m bench [--quick] [--unix] [--output results.json] [--baseline previous.json]
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable, Dict, Optional
+
+from app.moonraker import Moonraker
+from app.printer import Printer
+
+RESULTS_VERSION = 1
+WAIT_TIMEOUT = 120.0
+# thumbnails are fetched over http whatever the transport is, set by run()
+HTTP_ENDPOINT = None
+
+
+def rss_kb() -> int:
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        # peak instead of current, still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except Exception:
+        return None
+
+
+async def wait_field(printer: Printer, field: str, predicate: Callable[[Printer], bool]) -> asyncio.Event:
+    event = asyncio.Event()
+
+    def callback(printer: Printer, value: Any) -> None:
+        if predicate(printer):
+            event.set()
+    printer.add_listener(field, callback)
+    return event
+
+
+async def connect(endpoint: str) -> Moonraker:
+    moonraker = Moonraker(endpoint, http_endpoint=HTTP_ENDPOINT)
+    ready = await wait_field(moonraker.printer, 'webhooks.state', lambda p: p.data.webhooks.state == 'ready')
+    await moonraker.open()
+    await asyncio.wait_for(ready.wait(), WAIT_TIMEOUT)
+    return moonraker
+
+
+# returns seconds until the last update is applied
+async def stream(moonraker: Moonraker, count: int, rate: float) -> float:
+    done = await wait_field(
+        moonraker.printer, 'print_stats.filename', lambda p: p.data.print_stats.filename == 'bench-done'
+    )
+    moonraker.printer.data.print_stats.filename = None
+    start = time.perf_counter()
+    await moonraker.request_batch([('bench.stream', {'count': count, 'rate': rate})])
+    await asyncio.wait_for(done.wait(), WAIT_TIMEOUT)
+    return time.perf_counter() - start
+
+
+async def bench_throughput(endpoint: str, count: int) -> Dict[str, float]:
+    moonraker = await connect(endpoint)
+    try:
+        cpu_start = time.process_time()
+        elapsed = await stream(moonraker, count, rate=0)
+        cpu = time.process_time() - cpu_start
+    finally:
+        await moonraker.close()
+    return {
+        'updates': count,
+        'seconds': elapsed,
+        'updates_per_second': count / elapsed,
+        'cpu_us_per_update': cpu / count * 1e6,
+    }
+
+
+async def bench_paced(endpoint: str, rate: float, duration: float) -> Dict[str, float]:
+    count = int(rate * duration)
+    moonraker = await connect(endpoint)
+    try:
+        cpu_start = time.process_time()
+        elapsed = await stream(moonraker, count, rate=rate)
+        cpu = time.process_time() - cpu_start
+    finally:
+        await moonraker.close()
+    return {
+        'rate': rate,
+        'updates': count,
+        'cpu_us_per_update': cpu / count * 1e6,
+        'cpu_load': cpu / elapsed,
+        'lag_seconds': max(elapsed - count / rate, 0.0),
+    }
+
+
+async def bench_memory(endpoint: str, count: int) -> Dict[str, float]:
+    moonraker = await connect(endpoint)
+    try:
+        # warm up caches, interned strings, allocator arenas
+        await stream(moonraker, min(count // 10, 10000), rate=0)
+        gc.collect()
+        start_rss = rss_kb()
+        await stream(moonraker, count, rate=0)
+        gc.collect()
+        end_rss = rss_kb()
+    finally:
+        await moonraker.close()
+    return {
+        'updates': count,
+        'rss_start_kb': start_rss,
+        'rss_growth_kb': end_rss - start_rss,
+        'rss_growth_kb_per_100k_updates': (end_rss - start_rss) * 100000 / count,
+    }
+
+
+async def bench_reconnect(endpoint: str, cycles: int) -> Dict[str, float]:
+    moonraker = await connect(endpoint)
+    times = []
+    try:
+        for _ in range(cycles):
+            ready = await wait_field(
+                moonraker.printer, 'webhooks.state', lambda p: p.data.webhooks.state == 'ready'
+            )
+            ready.clear()
+            start = time.perf_counter()
+            try:
+                await moonraker.request_batch([('bench.disconnect', None)])
+            except Exception:
+                # the connection is closed before the response
+                pass
+            await asyncio.wait_for(ready.wait(), WAIT_TIMEOUT)
+            times.append(time.perf_counter() - start)
+    finally:
+        await moonraker.close()
+    return {
+        'cycles': cycles,
+        'avg_seconds': sum(times) / len(times),
+        'max_seconds': max(times),
+    }
+
+
+async def bench_thumbnails(endpoint: str, count: int) -> Dict[str, float]:
+    moonraker = await connect(endpoint)
+    try:
+        start = time.perf_counter()
+        for index in range(count):
+            await moonraker.get_thumbnail(f'bench/.thumbs/file_{index}.png', 1700000000.0)
+        cold = (time.perf_counter() - start) / count
+        start = time.perf_counter()
+        for index in range(count):
+            await moonraker.get_thumbnail(f'bench/.thumbs/file_{index}.png', 1700000000.0)
+        cached = (time.perf_counter() - start) / count
+    finally:
+        await moonraker.close()
+    return {'count': count, 'cold_ms': cold * 1000, 'cached_ms': cached * 1000}
+
+
+async def start_server(port: int, unix_path: Optional[str]) -> subprocess.Popen:
+    # separate process, so the server doesn't share CPU time and memory with the measured client
+    command = [sys.executable, '-m', 'bench.fake_moonraker', '--port', str(port)]
+    if unix_path:
+        command += ['--unix', unix_path]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    line = await asyncio.get_running_loop().run_in_executor(None, process.stdout.readline)
+    if not line:
+        raise RuntimeError('failed to start fake moonraker')
+    return process
+
+
+async def run(arguments: argparse.Namespace) -> dict:
+    global HTTP_ENDPOINT
+    scale = 0.1 if arguments.quick else 1.0
+    HTTP_ENDPOINT = f'127.0.0.1:{arguments.port}'
+    unix_path = os.path.join(tempfile.mkdtemp(), 'moonraker.sock') if arguments.unix else None
+    endpoint = f'unix:{unix_path}' if unix_path else HTTP_ENDPOINT
+    server = await start_server(arguments.port, unix_path)
+    try:
+        benchmarks = {
+            'throughput': lambda: bench_throughput(endpoint, int(50000 * scale)),
+            'paced': lambda: bench_paced(endpoint, rate=200, duration=10 * scale),
+            'memory': lambda: bench_memory(endpoint, int(200000 * scale)),
+            'reconnect': lambda: bench_reconnect(endpoint, cycles=2 if arguments.quick else 3),
+            'thumbnails': lambda: bench_thumbnails(endpoint, int(200 * scale)),
+        }
+        selected = arguments.only.split(',') if arguments.only else list(benchmarks)
+        results = {}
+        for name in selected:
+            print(f'running {name}...', file=sys.stderr, flush=True)
+            results[name] = await benchmarks[name]()
+    finally:
+        server.terminate()
+        server.wait()
+        if unix_path:
+            os.unlink(unix_path)
+            os.rmdir(os.path.dirname(unix_path))
+
+    return {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'quick': arguments.quick,
+        'transport': 'unix' if arguments.unix else 'websocket',
+        'results': results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> str:
+    lines = []
+    for name, values in current['results'].items():
+        for key, value in values.items():
+            previous = baseline.get('results', {}).get(name, {}).get(key)
+            if not isinstance(value, (int, float)) or not previous:
+                continue
+            change = (value - previous) / previous * 100
+            lines.append(f'{name}.{key}: {previous:.4g} -> {value:.4g} ({change:+.1f}%)')
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='klipper telegram bot benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller runs, for a fast sanity check')
+    parser.add_argument('--only', help='comma separated benchmarks to run')
+    parser.add_argument('--port', type=int, default=7126, help='port of the fake moonraker')
+    parser.add_argument('--unix', action='store_true', help='connect through a unix socket instead of the websocket')
+    parser.add_argument('--output', metavar='PATH', help='write results as json to the file instead of stdout')
+    parser.add_argument('--baseline', metavar='PATH', help='print changes against previous results')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(arguments))
+
+    text = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            print(compare(json.load(file), results), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# control methods: "bench.stream" {count, rate} pushes status updates (the last sets filename "bench-done"),
+# "bench.disconnect" closes the websocket
+
+import argparse
+import asyncio
+import logging
+import math
+import ujson
+
+from aiohttp import web
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+FILE_COUNT = 200
+THUMBNAIL_SIZE = 16 * 1024
+# pushing paced updates in ticks keeps timer overhead low at high rates
+TICK_INTERVAL = 0.01
+
+
+def make_status(index: int) -> dict:
+    phase = index / 50
+    return {
+        'extruder': {'temperature': 210.0 + math.sin(phase), 'power': 0.5 + 0.1 * math.cos(phase)},
+        'heater_bed': {'temperature': 60.0 + 0.1 * math.sin(phase), 'power': 0.3},
+        'gcode_move': {
+            'gcode_position': [100.0 + index % 100, 100.0, 0.2 * (1 + index // 1000), 1000.0 + index],
+            'position': [100.0 + index % 100, 100.0, 0.2 * (1 + index // 1000), 1000.0 + index],
+        },
+        'toolhead': {'position': [100.0 + index % 100, 100.0, 0.2, 1000.0 + index], 'print_time': index * 0.25},
+        'motion_report': {'live_velocity': 100.0, 'live_position': [100.0 + index % 100, 100.0, 0.2, 0.0]},
+        'print_stats': {'print_duration': index * 0.25, 'filament_used': index * 0.5},
+        'display_status': {'progress': min(index / 100000, 1.0)},
+        'virtual_sdcard': {'progress': min(index / 100000, 1.0), 'file_position': index * 100},
+    }
+
+
+def make_initial_status() -> dict:
+    status = make_status(0)
+    status['print_stats'].update({'state': 'printing', 'filename': 'benchy.gcode', 'message': ''})
+    status['extruder']['target'] = 210.0
+    status['heater_bed']['target'] = 60.0
+    status['display_status']['message'] = None
+    status['webhooks'] = {'state': 'ready', 'state_message': 'Printer is ready'}
+    return status
+
+
+class FakeMoonraker:
+    def __init__(self) -> None:
+        self._app = web.Application()
+        self._app.router.add_get('/access/oneshot_token', self._handle_token)
+        self._app.router.add_get('/websocket', self._handle_websocket)
+        self._app.router.add_get('/server/files/gcodes/{path:.*}', self._handle_file)
+        self._runner = None
+        self._unix_server: Optional[asyncio.AbstractServer] = None
+        self._thumbnail = b'\x89PNG\r\n\x1a\n' + bytes(THUMBNAIL_SIZE)
+
+    async def open(self, host: str, port: int, unix_path: Optional[str] = None) -> None:
+        self._runner = web.AppRunner(self._app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if unix_path:
+            self._unix_server = await asyncio.start_unix_server(self._handle_unix, unix_path)
+
+    async def close(self) -> None:
+        if self._unix_server:
+            self._unix_server.close()
+            await self._unix_server.wait_closed()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _handle_token(self, request: web.Request) -> web.Response:
+        return web.json_response({'result': 'bench-token'})
+
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._thumbnail, content_type='image/png')
+
+    async def _handle_websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        stream_tasks = []
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                if not await self._handle_frame(message.data, ws.send_str, stream_tasks):
+                    await ws.close()
+                    break
+        finally:
+            for task in stream_tasks:
+                task.cancel()
+        return ws
+
+    async def _handle_unix(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        async def send(frame: str) -> None:
+            writer.write(frame.encode() + b'\x03')
+            await writer.drain()
+
+        stream_tasks = []
+        try:
+            while True:
+                try:
+                    frame = await reader.readuntil(b'\x03')
+                except asyncio.IncompleteReadError:
+                    break
+                if not await self._handle_frame(frame[:-1], send, stream_tasks):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            for task in stream_tasks:
+                task.cancel()
+            writer.close()
+
+    # False if the connection should be closed
+    async def _handle_frame(self, frame, send: Callable[[str], Awaitable[None]], stream_tasks: list) -> bool:
+        data = ujson.loads(frame)
+        calls = data if isinstance(data, list) else [data]
+
+        responses = []
+        for call in calls:
+            method = call.get('method')
+            if method == 'bench.stream':
+                params = call.get('params') or {}
+                stream_tasks.append(asyncio.create_task(
+                    self._stream(send, params.get('count', 1000), params.get('rate', 0))
+                ))
+            elif method == 'bench.disconnect':
+                return False
+            responses.append(self._respond(call))
+        await send(ujson.dumps(responses if isinstance(data, list) else responses[0]))
+        return True
+
+    def _respond(self, data: dict) -> dict:
+        method = data.get('method')
+        params = data.get('params') or {}
+        if method == 'printer.objects.subscribe' or method == 'printer.objects.query':
+            status = make_initial_status()
+            objects = params.get('objects', {})
+            result = {'eventtime': 0.0, 'status': {name: status.get(name, {}) for name in objects}}
+        elif method == 'server.files.list':
+            result = [
+                {'path': f'bench/file_{index}.gcode', 'modified': 1700000000.0 + index, 'size': 1000000}
+                for index in range(FILE_COUNT)
+            ]
+        elif method == 'server.files.metadata':
+            result = {
+                'filename': params.get('filename'), 'estimated_time': 3600, 'filament_total': 5000,
+                'thumbnails': [{'width': 300, 'height': 300, 'relative_path': '.thumbs/file-300x300.png'}]
+            }
+        else:
+            result = 'ok'
+        return {'jsonrpc': '2.0', 'id': data.get('id'), 'result': result}
+
+    async def _stream(self, send: Callable[[str], Awaitable[None]], count: int, rate: float) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for index in range(1, count + 1):
+            status = make_status(index)
+            if index == count:
+                status['print_stats']['filename'] = 'bench-done'
+            await send(ujson.dumps({
+                'jsonrpc': '2.0', 'method': 'notify_status_update', 'params': [status, index * 0.25]
+            }))
+            if rate > 0 and index % max(1, int(rate * TICK_INTERVAL)) == 0:
+                delay = start + index / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif index % 100 == 0:
+                # let the client side of a same-process run make progress
+                await asyncio.sleep(0)
+
+
+async def serve(host: str, port: int, unix_path: Optional[str]) -> None:
+    server = FakeMoonraker()
+    await server.open(host, port, unix_path)
+    print(f'fake moonraker listening on {host}:{port}' + (f' and unix:{unix_path}' if unix_path else ''), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fake moonraker server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7126)
+    parser.add_argument('--unix', metavar='PATH', help='also listen on a unix socket')
+    arguments = parser.parse_args()
+    try:
+        asyncio.run(serve(arguments.host, arguments.port, arguments.unix))
+    except KeyboardInterrupt:
+        pass